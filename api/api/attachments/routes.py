@@ -0,0 +1,116 @@
+from typing import Dict, List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from api.accounts.auth import get_current_active_verified_user
+from api.accounts.models import Account
+from api.database import get_database
+from api.database.client import Database
+from common.database.models.attachment import (
+    AttachmentMessageRef,
+    SimilarAttachmentOut,
+)
+from common.utils import IMAGE_HASH_SEGMENTS, get_hash_segments, hamming_distance
+
+# max. number of messages listed per similar attachment
+MAX_MESSAGES_PER_ATTACHMENT = 20
+# max. number of candidates compared, uniform images share the same segments
+MAX_CANDIDATES = 1000
+
+
+def get_attachments_router(app):
+
+    router = APIRouter()
+    current_active_verified_user = get_current_active_verified_user()
+
+    @router.get(
+        "/attachments/{id}/similar",
+        response_description="List visually similar images across chats",
+        tags=["attachments"],
+        response_model=List[SimilarAttachmentOut],
+        response_model_exclude_none=True,
+    )
+    async def list_similar_attachments(
+        id: str,
+        max_distance: int = Query(
+            IMAGE_HASH_SEGMENTS - 1, ge=0, le=IMAGE_HASH_SEGMENTS - 1
+        ),
+        limit: int = Query(20, ge=1, le=100),
+        account: Account = Depends(current_active_verified_user),
+        database: Database = Depends(get_database),
+    ):
+        attachment = await database.attachments.find_one({"_id": id}, {"phash": 1})
+
+        if not attachment:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+        if not attachment.phash:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Attachment has no perceptual hash (only images are hashed)",
+            )
+
+        # candidates share at least one hash segment (multi-index hashing)
+        similar_attachments = []
+        async for candidate in database.attachments.find(
+            {
+                "_id": {"$ne": id},
+                "phash_segments": {"$in": get_hash_segments(attachment.phash)},
+            },
+            {"_id": 1, "type": 1, "phash": 1, "ocr": 1, "storage_refs": 1},
+            limit=MAX_CANDIDATES,
+        ):
+            distance = hamming_distance(attachment.phash, candidate.phash)
+            if distance <= max_distance:
+                similar_attachments.append(
+                    SimilarAttachmentOut(
+                        id=candidate.id,
+                        type=candidate.type,
+                        distance=distance,
+                        ocr=candidate.ocr,
+                        storage_refs=candidate.storage_refs,
+                    )
+                )
+
+        similar_attachments.sort(key=lambda a: a.distance)
+        similar_attachments = similar_attachments[:limit]
+
+        # messages containing the similar files
+        messages: Dict[str, List[AttachmentMessageRef]] = {}
+        async for doc in database.messages.aggregate(
+            [
+                {
+                    "$match": {
+                        "attachment.raw.file_unique_id": {
+                            "$in": [a.id for a in similar_attachments]
+                        }
+                    }
+                },
+                {"$sort": {"date": -1}},
+                {
+                    "$group": {
+                        "_id": "$attachment.raw.file_unique_id",
+                        "messages": {
+                            "$push": {"_id": "$_id", "chat": "$chat", "date": "$date"}
+                        },
+                    }
+                },
+                {
+                    "$project": {
+                        "messages": {
+                            "$slice": ["$messages", MAX_MESSAGES_PER_ATTACHMENT]
+                        }
+                    }
+                },
+            ]
+        ):
+            messages[doc["_id"]] = [
+                AttachmentMessageRef(**message) for message in doc["messages"]
+            ]
+
+        for similar_attachment in similar_attachments:
+            similar_attachment.messages = messages.get(similar_attachment.id, [])
+
+        return similar_attachments
+
+    return router
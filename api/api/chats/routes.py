@@ -1,17 +1,42 @@
 from datetime import datetime, timedelta
-from typing import Tuple
+from typing import Literal
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 
 from api.accounts.auth import get_current_active_verified_user
 from api.accounts.models import Account
 from api.chats.validators import parse_chat_filter, parse_chat_sort
 from api.database import get_database
-from api.database.aggregations import aggregate_metrics
+from api.database.aggregations import (
+    aggregate_chat_sparklines,
+    aggregate_metric_series,
+)
 from api.database.client import Database
-from api.pagination import PaginatedChats, Pagination
-from api.validators import parse_projection_params, parse_search_params
-from common.database.models.chat import ChatIn, ChatMetrics, ChatOut
+from api.pagination import (
+    PaginatedChats,
+    Pagination,
+    PaginationParams,
+    apply_cursor,
+    count_documents,
+    get_cursor_projection,
+)
+from api.validators import (
+    MetricsParams,
+    parse_metrics_params,
+    parse_projection_params,
+    parse_search_params,
+)
+from common.database.aggregations import ACTIVITY_SERIES, GROWTH_SERIES
+from common.database.models.chat import (
+    ChatIn,
+    ChatMetrics,
+    ChatOut,
+    ChatSparklines,
+)
+
+# max. number of chats and days of sparklines
+MAX_SPARKLINE_CHATS = 100
+MAX_SPARKLINE_DAYS = 30
 
 
 def get_chats_router(app):
@@ -33,15 +58,22 @@ def get_chats_router(app):
         sort: dict = Depends(parse_chat_sort),
         search: dict = Depends(parse_search_params),
         projection: dict = Depends(parse_projection_params),
-        pagination: Tuple[int, int, int] = Depends(pagination.parse_params),
+        pagination: PaginationParams = Depends(pagination.parse_params),
+        count: bool = Query(False, description="Include total count"),
         account: Account = Depends(current_active_verified_user),
         database: Database = Depends(get_database),
     ):
-        offset, limit, max_limit = pagination
+        offset, limit, max_limit, cursor = pagination
 
         if search:
             filter.update(search)
 
+        total = await count_documents(database.chats, filter) if count else None
+
+        # keyset pagination: range query on sort key and id after the cursor
+        filter, sort = apply_cursor(filter, sort, cursor)
+        projection = get_cursor_projection(projection, sort)
+
         result = [
             doc
             async for doc in database.chats.find(
@@ -53,7 +85,38 @@ def get_chats_router(app):
             )
         ]
 
-        return PaginatedChats.create(data=result, params=pagination)
+        return PaginatedChats.create(
+            data=result, params=pagination, sort=sort, total=total
+        )
+
+    # registered before "/chats/{id}", which would match "/chats/metrics"
+    @app.get(
+        "/chats/metrics",
+        response_description="Get a compact metric series of multiple chats",
+        tags=["chats"],
+        response_model=ChatSparklines,
+    )
+    async def list_chat_sparklines(
+        ids: str = Query(
+            ..., regex=r"^-?\d+(,-?\d+)*$", description="Comma-separated chat ids"
+        ),
+        metric: Literal["activity", "growth"] = Query("activity"),
+        days: int = Query(7, ge=1, le=MAX_SPARKLINE_DAYS),
+        account: Account = Depends(current_active_verified_user),
+        database: Database = Depends(get_database),
+    ):
+        # unique ids in requested order
+        chat_ids = list(dict.fromkeys(int(id) for id in ids.split(",")))
+
+        if len(chat_ids) > MAX_SPARKLINE_CHATS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Too many chats (max. {MAX_SPARKLINE_CHATS})",
+            )
+
+        series = ACTIVITY_SERIES if metric == "activity" else GROWTH_SERIES
+
+        return await aggregate_chat_sparklines(database, chat_ids, series, days)
 
     @app.get(
         "/chats/{id}",
@@ -65,6 +128,7 @@ def get_chats_router(app):
     )
     async def get_chat(
         id: int,
+        metrics_params: MetricsParams = Depends(parse_metrics_params),
         account: Account = Depends(current_active_verified_user),
         database: Database = Depends(get_database),
     ):
@@ -73,49 +137,47 @@ def get_chats_router(app):
         if not chat:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-        activity_total = await aggregate_metrics(
+        range_match, resolution, points = metrics_params
+        metrics = await aggregate_metric_series(
             database,
-            {"metadata.chat_id": id, "metadata.type": "message_posted"},
-            "$sum",
+            {"metadata.chat_id": id, **range_match},
+            {**ACTIVITY_SERIES, **GROWTH_SERIES},
+            last_day_since=datetime.utcnow() - timedelta(days=1),
+            resolution=resolution,
+            max_points=points,
         )
+        chat.metrics = ChatMetrics(**metrics)
 
-        growth_total = await aggregate_metrics(
-            database,
-            {"metadata.chat_id": id, "metadata.type": "chat_members_count"},
-            "$avg",
-        )
+        # TODO: paginate members
 
-        yesterday = datetime.utcnow() - timedelta(days=1)
-        activity_last_day = await aggregate_metrics(
-            database,
-            {
-                "metadata.chat_id": id,
-                "metadata.type": "message_posted",
-                "ts": {"$gte": yesterday},
-            },
-            "$sum",
-        )
+        return chat
 
-        growth_last_day = await aggregate_metrics(
-            database,
-            {
-                "metadata.chat_id": id,
-                "metadata.type": "chat_members_count",
-                "ts": {"$gte": yesterday},
-            },
-            "$avg",
-        )
+    @router.get(
+        "/chats/{id}/metrics",
+        response_description="Get the metric series of a chat within a range",
+        tags=["chats"],
+        response_model=ChatMetrics,
+        response_model_exclude_none=True,
+    )
+    async def get_chat_metrics(
+        id: int,
+        metrics_params: MetricsParams = Depends(parse_metrics_params),
+        account: Account = Depends(current_active_verified_user),
+        database: Database = Depends(get_database),
+    ):
+        if not await database.chats.find_one({"_id": id}, {"_id": 1}):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-        chat.metrics = ChatMetrics(
-            activity_total=activity_total,
-            growth_total=growth_total,
-            activity_last_day=activity_last_day,
-            growth_last_day=growth_last_day,
+        range_match, resolution, points = metrics_params
+        metrics = await aggregate_metric_series(
+            database,
+            {"metadata.chat_id": id, **range_match},
+            {**ACTIVITY_SERIES, **GROWTH_SERIES},
+            resolution=resolution,
+            max_points=points,
         )
 
-        # TODO: paginate members
-
-        return chat
+        return ChatMetrics(**metrics)
 
     @router.put(
         "/chats/{id}",
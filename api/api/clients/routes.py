@@ -1,6 +1,4 @@
-from typing import Tuple
-
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.responses import JSONResponse
 
 from api.accounts.auth import get_current_active_verified_user
@@ -10,7 +8,14 @@ from api.clients.models import ClientCreate, ClientCreateSession
 from api.clients.validators import parse_client_filter, parse_client_sort
 from api.database import get_database
 from api.database.client import Database
-from api.pagination import PaginatedClients, Pagination
+from api.pagination import (
+    PaginatedClients,
+    Pagination,
+    PaginationParams,
+    apply_cursor,
+    count_documents,
+    get_cursor_projection,
+)
 from api.validators import parse_projection_params, parse_search_params
 from common.database.models.client import ClientIn, ClientOut
 from common.database.models.pyobjectid import PyObjectId
@@ -35,15 +40,22 @@ def get_clients_router(app):
         sort: dict = Depends(parse_client_sort),
         search: dict = Depends(parse_search_params),
         projection: dict = Depends(parse_projection_params),
-        pagination: Tuple[int, int, int] = Depends(pagination.parse_params),
+        pagination: PaginationParams = Depends(pagination.parse_params),
+        count: bool = Query(False, description="Include total count"),
         account: Account = Depends(current_active_verified_user),
         database: Database = Depends(get_database),
     ):
-        offset, limit, max_limit = pagination
+        offset, limit, max_limit, cursor = pagination
 
         if search:
             filter.update(search)
 
+        total = await count_documents(database.clients, filter) if count else None
+
+        # keyset pagination: range query on sort key and id after the cursor
+        filter, sort = apply_cursor(filter, sort, cursor)
+        projection = get_cursor_projection(projection, sort)
+
         result = [
             doc
             async for doc in database.clients.find(
@@ -55,7 +67,9 @@ def get_clients_router(app):
             )
         ]
 
-        return PaginatedClients.create(data=result, params=pagination)
+        return PaginatedClients.create(
+            data=result, params=pagination, sort=sort, total=total
+        )
 
     @app.post(
         "/clients",
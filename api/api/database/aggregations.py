@@ -1,27 +1,135 @@
-from datetime import timedelta
-from typing import Dict, Literal
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 
 from api.database.client import Database
+from api.validators import check_metric_buckets
 from common.database.aggregations import (
-    generate_metrics_aggregation_pipeline,
-    transform_growth_activity_metrics,
+    MetricResolution,
+    MetricSeries,
+    generate_chat_sparklines_pipeline,
+    generate_metric_series_facet_pipeline,
+    get_bucket_delta,
+    get_metric_range,
+    get_metric_resolution,
+    get_metric_rollup_match,
+    transform_metric_series,
+    transform_sparkline,
+    truncate_to_bucket,
 )
 from common.database.models.aggregations import AggregatedMetrics
+from common.database.models.chat import ChatSparkline, ChatSparklines
 
+# max. number of buckets of sparklines
+SPARKLINE_MAX_POINTS = 50
 
-async def aggregate_metrics(
+
+async def get_start_date(
+    database: Database, match: Dict, types: List[str]
+) -> Optional[datetime]:
+    """
+    Get the start date of the range of a match. Ranges without start date begin
+    with the first rollup.
+    """
+    start_date, _ = get_metric_range(match)
+
+    if not start_date:
+        first_rollup = await database.metrics_hourly.find_one(
+            {**get_metric_rollup_match(match), "type": {"$in": types}},
+            {"ts": 1},
+            sort=[("ts", 1)],
+        )
+        start_date = first_rollup.ts if first_rollup else None
+
+    return start_date
+
+
+async def get_resolution(
+    database: Database, match: Dict, types: List[str]
+) -> MetricResolution:
+    """
+    Choose a resolution for the range of a match.
+    """
+    start_date = await get_start_date(database, match, types)
+    return get_metric_resolution(start_date, get_metric_range(match)[1])
+
+
+async def aggregate_metric_series(
     database: Database,
     match: Dict,
-    accumulator: Literal["$sum", "$avg"],
-    time_delta: timedelta = timedelta(hours=1),
-) -> AggregatedMetrics:
+    series: MetricSeries,
+    last_day_since: Optional[datetime] = None,
+    resolution: Optional[MetricResolution] = None,
+    max_points: Optional[int] = None,
+) -> Dict[str, AggregatedMetrics]:
+    """
+    Aggregate all series in a single query (see "transform_metric_series").
+    """
+    types = [type for type, _ in series.values()]
 
-    pipeline = generate_metrics_aggregation_pipeline(match, accumulator, time_delta)
+    if not resolution:
+        resolution = await get_resolution(database, match, types)
+    elif not get_metric_range(match)[0]:
+        # requested resolutions without range start are limited by the first rollup
+        start_date = await get_start_date(database, match, types)
+        if start_date:
+            check_metric_buckets(start_date, get_metric_range(match)[1], resolution)
+
+    pipeline = generate_metric_series_facet_pipeline(
+        match, series, resolution, last_day_since
+    )
 
-    aggregations = [doc async for doc in database.metrics.aggregate(pipeline)]
+    # minutes are not pre-aggregated
+    if resolution[0] == "minute":
+        collection = database.metrics
+    else:
+        collection = database.metrics_hourly
 
-    metrics_aggregated = transform_growth_activity_metrics(
-        aggregations, accumulator, time_delta
+    facets = [doc async for doc in collection.aggregate(pipeline)]
+
+    return transform_metric_series(
+        facets[0] if facets else {}, series, resolution, max_points
+    )
+
+
+async def aggregate_chat_sparklines(
+    database: Database, chat_ids: List[int], series: MetricSeries, days: int
+) -> ChatSparklines:
+    """
+    Aggregate one metric series of the last days for multiple chats in a single
+    query, at a resolution fitting "SPARKLINE_MAX_POINTS".
+    """
+    [(type, accumulator)] = series.values()
+
+    end_date = datetime.utcnow()
+    resolution = get_metric_resolution(
+        end_date - timedelta(days=days), end_date, SPARKLINE_MAX_POINTS
+    )
+    start_date = truncate_to_bucket(end_date - timedelta(days=days), resolution)
+    size = (end_date - start_date) // get_bucket_delta(resolution) + 1
+
+    pipeline = generate_chat_sparklines_pipeline(
+        chat_ids, type, accumulator, start_date, resolution
     )
+    buckets = {
+        doc["_id"]: doc async for doc in database.metrics_hourly.aggregate(pipeline)
+    }
 
-    return metrics_aggregated
+    return ChatSparklines(
+        type=type,
+        start_date=start_date,
+        time_delta=int(get_bucket_delta(resolution).total_seconds()),
+        chats=[
+            ChatSparkline(
+                id=id,
+                data=transform_sparkline(
+                    buckets.get(id, {}).get("dates", []),
+                    buckets.get(id, {}).get("values", []),
+                    accumulator,
+                    start_date,
+                    resolution,
+                    size,
+                ),
+            )
+            for id in chat_ids
+        ],
+    )
@@ -8,14 +8,27 @@ from motor.motor_asyncio import (
 from pymongo.results import DeleteResult, InsertOneResult, UpdateResult
 
 from api.accounts.models import Account
+from common.database.models.attachment import Attachment
 from common.database.models.chat import Chat
 from common.database.models.client import Client
+from common.database.models.counters import Counters
 from common.database.models.message import Message
-from common.database.models.metric import Metric
+from common.database.models.metric import Metric, MetricRollup
 from common.database.models.user import User
 from common.settings import settings
 
-T = TypeVar("T", Client, Chat, Message, User, Account, Metric)
+T = TypeVar(
+    "T",
+    Client,
+    Chat,
+    Message,
+    User,
+    Account,
+    Metric,
+    MetricRollup,
+    Attachment,
+    Counters,
+)
 
 
 class Collection(Generic[T]):
@@ -108,6 +121,21 @@ class MetricsCollection(Collection[Metric]):
     model = Metric
 
 
+class MetricRollupsCollection(Collection[MetricRollup]):
+    name = "metrics_hourly"
+    model = MetricRollup
+
+
+class AttachmentsCollection(Collection[Attachment]):
+    name = "attachments"
+    model = Attachment
+
+
+class CountersCollection(Collection[Counters]):
+    name = "counters"
+    model = Counters
+
+
 class Database:
     def __init__(self, connect=True) -> None:
         if connect:
@@ -129,6 +157,9 @@ class Database:
         self.users = UsersCollection(self.__db)
         self.accounts = AccountsCollection(self.__db)
         self.metrics = MetricsCollection(self.__db)
+        self.metrics_hourly = MetricRollupsCollection(self.__db)
+        self.attachments = AttachmentsCollection(self.__db)
+        self.counters = CountersCollection(self.__db)
 
     def __get_database(self) -> AsyncIOMotorDatabase:
         return self.__client[settings.mongo_db_name]
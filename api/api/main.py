@@ -6,6 +6,7 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from api.accounts.auth import init_fast_api_users
 from api.accounts.routes import get_accounts_router
+from api.attachments.routes import get_attachments_router
 from api.chats.routes import get_chats_router
 from api.clients.routes import get_clients_router
 from api.database import database
@@ -38,6 +39,7 @@ async def configure_db_and_routes():
     app.include_router(get_chats_router(app))
     app.include_router(get_users_router(app))
     app.include_router(get_metrics_router(app))
+    app.include_router(get_attachments_router(app))
 
     if settings.storage_endpoint and len(settings.save_attachment_types) >= 1:
         storage.connect()
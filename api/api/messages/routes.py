@@ -1,13 +1,18 @@
-from typing import Tuple
-
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 
 from api.accounts.auth import get_current_active_verified_user
 from api.accounts.models import Account
 from api.database import get_database
 from api.database.client import Database
 from api.messages.validators import parse_message_filter, parse_message_sort
-from api.pagination import PaginatedMessages, Pagination
+from api.pagination import (
+    PaginatedMessages,
+    Pagination,
+    PaginationParams,
+    apply_cursor,
+    count_documents,
+    get_cursor_projection,
+)
 from api.validators import parse_projection_params, parse_search_params
 from common.database.models.message import MessageIn, MessageOut
 
@@ -31,15 +36,22 @@ def get_messages_router(app):
         sort: dict = Depends(parse_message_sort),
         search: dict = Depends(parse_search_params),
         projection: dict = Depends(parse_projection_params),
-        pagination: Tuple[int, int, int] = Depends(pagination.parse_params),
+        pagination: PaginationParams = Depends(pagination.parse_params),
+        count: bool = Query(False, description="Include total count"),
         account: Account = Depends(current_active_verified_user),
         database: Database = Depends(get_database),
     ):
-        offset, limit, max_limit = pagination
+        offset, limit, max_limit, cursor = pagination
 
         if search:
             filter.update(search)
 
+        total = await count_documents(database.messages, filter) if count else None
+
+        # keyset pagination: range query on sort key and id after the cursor
+        filter, sort = apply_cursor(filter, sort, cursor)
+        projection = get_cursor_projection(projection, sort)
+
         result = [
             doc
             async for doc in database.messages.find(
@@ -51,7 +63,9 @@ def get_messages_router(app):
             )
         ]
 
-        return PaginatedMessages.create(data=result, params=pagination)
+        return PaginatedMessages.create(
+            data=result, params=pagination, sort=sort, total=total
+        )
 
     @router.get(
         "/messages/{id}",
@@ -3,8 +3,10 @@ from fastapi import APIRouter, Depends
 from api.accounts.auth import get_current_active_verified_user
 from api.accounts.models import Account
 from api.database import get_database
-from api.database.aggregations import aggregate_metrics
+from api.database.aggregations import aggregate_metric_series
 from api.database.client import Database
+from api.validators import MetricsParams, parse_metrics_params
+from common.database.aggregations import ACTIVITY_SERIES, GROWTH_SERIES
 from common.database.models.chat import GlobalMetrics
 
 
@@ -21,39 +23,49 @@ def get_metrics_router(app):
         response_model_exclude_unset=True,
     )
     async def list_metrics(
+        metrics_params: MetricsParams = Depends(parse_metrics_params),
         account: Account = Depends(get_current_active_verified_user()),
         database: Database = Depends(get_database),
     ):
+        range_match, resolution, points = metrics_params
 
-        users_count = await database.users.count({})
-        chats_count = await database.chats.count({})
-        messages_count = await database.messages.count({})
-        photos_count = await database.messages.count({"attachment.type": "photo"})
-        videos_count = await database.messages.count({"attachment.type": "video"})
-        voices_count = await database.messages.count({"attachment.type": "voice"})
+        # counters materialized by the worker (see "metrics.reconcile_counters")
+        counters = await database.counters.find_one({"_id": "global"})
 
-        activity_total = await aggregate_metrics(
-            database,
-            {"metadata.type": "message_posted"},
-            "$sum",
-        )
+        if counters and counters.reconciled_at:
+            metrics = GlobalMetrics(
+                **counters.dict(include=set(GlobalMetrics.__fields__))
+            )
 
-        growth_total = await aggregate_metrics(
-            database,
-            {"metadata.type": "chat_members_count"},
-            "$avg",
-        )
+            # materialized series cover all metrics at automatic resolution
+            if not (range_match or resolution or points):
+                return metrics
+        else:
+            # count on the fly until the counters are reconciled for the first time
+            metrics = GlobalMetrics(
+                users_count=await database.users.count({}),
+                chats_count=await database.chats.count({}),
+                messages_count=await database.messages.count({}),
+                photos_count=await database.messages.count(
+                    {"attachment.type": "photo"}
+                ),
+                videos_count=await database.messages.count(
+                    {"attachment.type": "video"}
+                ),
+                voices_count=await database.messages.count(
+                    {"attachment.type": "voice"}
+                ),
+            )
 
-        metrics = GlobalMetrics(
-            users_count=users_count,
-            chats_count=chats_count,
-            messages_count=messages_count,
-            photos_count=photos_count,
-            activity_total=activity_total,
-            growth_total=growth_total,
-            videos_count=videos_count,
-            voices_count=voices_count,
+        series_metrics = await aggregate_metric_series(
+            database,
+            range_match,
+            {**ACTIVITY_SERIES, **GROWTH_SERIES},
+            resolution=resolution,
+            max_points=points,
         )
+        metrics.activity_total = series_metrics["activity_total"]
+        metrics.growth_total = series_metrics["growth_total"]
 
         return metrics
 
@@ -1,14 +1,192 @@
-from typing import Any, List, Tuple
+import base64
+import binascii
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
 
-from fastapi import Query
+from bson import ObjectId, json_util
+from fastapi import HTTPException, Query, status
 from pydantic import BaseModel
+from pymongo.errors import ExecutionTimeout
 
+from api.database.client import Collection
+from api.validators import SortParams
 from common.database.models.chat import ChatOut
 from common.database.models.client import ClientOut
 from common.database.models.message import MessageOut
 from common.database.models.user import UserOut
 
-PaginationParams = Tuple[int, int, int]
+# skip, limit, max. limit and decoded cursor (if any)
+PaginationParams = Tuple[int, int, int, Optional[dict]]
+
+# types of sort key values and ids in cursors, anything else (e.g. query operators
+# like {"$ne": null}) is rejected
+CURSOR_VALUE_TYPES = (bool, int, float, str, datetime, ObjectId)
+
+
+def encode_cursor(key: str, value: Any, id: Any) -> str:
+    """
+    Create an opaque cursor from the sort key and id of the last document of a page.
+    Extended JSON keeps types like datetime and ObjectId.
+    """
+    data = json_util.dumps({"key": key, "value": value, "_id": id})
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        data = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    if (
+        not isinstance(data, dict)
+        or not isinstance(data.get("key", None), str)
+        or not isinstance(data.get("_id", None), CURSOR_VALUE_TYPES)
+        or not isinstance(data.get("value", None), CURSOR_VALUE_TYPES + (type(None),))
+    ):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    return data
+
+
+def get_cursor_sort(sort: SortParams) -> SortParams:
+    # "_id" is the tie breaker for documents with the same sort key
+    if any(key == "_id" for key, order in sort):
+        return sort
+
+    return sort + [("_id", sort[0][1] if sort else 1)]
+
+
+def get_cursor_filter(sort: SortParams, cursor: dict) -> dict:
+    """
+    Range predicate for documents after the cursor in sort order, so pages are
+    fetched by index lookups instead of skipping documents.
+    """
+    sort = get_cursor_sort(sort)
+    key, order = sort[0]
+    id_operator = "$lt" if sort[-1][1] == -1 else "$gt"
+    value = cursor.get("value", None)
+
+    if key == "_id":
+        return {"_id": {id_operator: cursor["_id"]}}
+
+    operator = "$lt" if order == -1 else "$gt"
+    same_value = {key: value, "_id": {id_operator: cursor["_id"]}}
+
+    # missing values are sorted before all other values
+    if value is None:
+        if order == -1:
+            return same_value
+        return {"$or": [same_value, {key: {"$ne": None}}]}
+
+    # missing values are sorted after all other values in descending order
+    if order == -1:
+        return {"$or": [{key: {operator: value}}, same_value, {key: None}]}
+
+    return {"$or": [{key: {operator: value}}, same_value]}
+
+
+def apply_cursor(
+    filter: dict, sort: SortParams, cursor: Optional[dict]
+) -> Tuple[dict, SortParams]:
+    """
+    Get filter and sort for the page after the cursor.
+    """
+    if not cursor:
+        return filter, get_cursor_sort(sort)
+
+    if cursor["key"] != get_cursor_sort(sort)[0][0]:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, detail="Cursor does not match sort order"
+        )
+
+    cursor_filter = get_cursor_filter(sort, cursor)
+    return (
+        {"$and": [filter, cursor_filter]} if filter else cursor_filter,
+        get_cursor_sort(sort),
+    )
+
+
+def get_cursor_projection(
+    projection: Optional[dict], sort: SortParams
+) -> Optional[dict]:
+    """
+    Make sure a projection returns the sort key and id, which the cursor of the next
+    page is created from.
+    """
+    if not projection:
+        return projection
+
+    keys = {key for key, order in get_cursor_sort(sort)}
+
+    def overlaps(field: str) -> bool:
+        # the same field, one of its parents or one of its children
+        return any(
+            field == key or key.startswith(f"{field}.") or field.startswith(f"{key}.")
+            for key in keys
+        )
+
+    # exclusion projections return the sort key and id once they are not excluded
+    is_exclusion = all(
+        not value for field, value in projection.items() if field != "_id"
+    )
+    cursor_projection = {
+        field: value for field, value in projection.items() if not overlaps(field)
+    }
+    if not is_exclusion:
+        cursor_projection.update({key: 1 for key in keys})
+
+    return cursor_projection or None
+
+
+# counts of filtered queries are capped, displayed as e.g. "10000+"
+COUNT_LIMIT = 10000
+COUNT_MAX_TIME_MS = 2000
+COUNT_CACHE_TTL_SECONDS = 60
+COUNT_CACHE_MAX_SIZE = 1000
+
+# total number of documents and whether it is capped at COUNT_LIMIT
+TotalCount = Tuple[int, bool]
+
+count_cache: Dict[str, Tuple[float, TotalCount]] = {}
+
+
+async def count_documents(collection: Collection, filter: dict) -> Optional[TotalCount]:
+    """
+    Count documents matching a filter: estimated from collection metadata without
+    filter, otherwise exact up to COUNT_LIMIT. Counts are cached for a short time.
+    Returns None if counting takes too long.
+    """
+    now = time.time()
+    # normalized filter, the same filter with different key order is the same entry
+    key = collection.name + json_util.dumps(filter, sort_keys=True)
+    cached = count_cache.get(key, None)
+
+    if cached and cached[0] > now:
+        return cached[1]
+
+    try:
+        if not filter:
+            count = await collection.collection.estimated_document_count()
+            total = (count, False)
+        else:
+            count = await collection.collection.count_documents(
+                filter, limit=COUNT_LIMIT + 1, maxTimeMS=COUNT_MAX_TIME_MS
+            )
+            total = (min(count, COUNT_LIMIT), count > COUNT_LIMIT)
+    except ExecutionTimeout:
+        return None
+
+    if len(count_cache) >= COUNT_CACHE_MAX_SIZE:
+        for expired_key in [k for k, v in count_cache.items() if v[0] <= now]:
+            del count_cache[expired_key]
+        if len(count_cache) >= COUNT_CACHE_MAX_SIZE:
+            count_cache.clear()
+
+    count_cache[key] = (now + COUNT_CACHE_TTL_SECONDS, total)
+
+    return total
 
 
 class Pagination:
@@ -19,9 +197,18 @@ class Pagination:
         self,
         skip: int = Query(0, ge=0),
         limit: int = Query(10, ge=0),
+        cursor: Optional[str] = Query(
+            None, description="Cursor of the next page (replaces skip)"
+        ),
     ) -> PaginationParams:
         capped_limit = min(self.maximum_limit, limit)
-        return (skip, capped_limit, self.maximum_limit)
+        decoded_cursor = decode_cursor(cursor) if cursor else None
+        return (
+            0 if decoded_cursor else skip,
+            capped_limit,
+            self.maximum_limit,
+            decoded_cursor,
+        )
 
     # Alternative pagination
     # async def page_size(
@@ -37,6 +224,9 @@ class PaginatedResponseInfo(BaseModel):
     offset: int
     limit: int
     max_limit: int
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+    total_is_capped: Optional[bool] = None
 
 
 class PaginatedResponse(BaseModel):
@@ -44,12 +234,35 @@ class PaginatedResponse(BaseModel):
     pagination: PaginatedResponseInfo
 
     @classmethod
-    def create(cls, data: List[Any], params: PaginationParams) -> "PaginatedResponse":
-        offset, limit, max_limit = params
+    def create(
+        cls,
+        data: List[Any],
+        params: PaginationParams,
+        sort: SortParams = [],
+        total: Optional[TotalCount] = None,
+    ) -> "PaginatedResponse":
+        offset, limit, max_limit, cursor = params
+        next_cursor = None
+
+        # more documents might follow if the page is full
+        if data and len(data) == limit:
+            key = get_cursor_sort(sort)[0][0]
+            last_doc = data[-1]
+            next_cursor = encode_cursor(
+                key,
+                getattr(last_doc, "id" if key == "_id" else key, None),
+                last_doc.id,
+            )
+
         return cls(
             data=data,
             pagination=PaginatedResponseInfo(
-                offset=offset, limit=limit, max_limit=max_limit
+                offset=offset,
+                limit=limit,
+                max_limit=max_limit,
+                next_cursor=next_cursor,
+                total=total[0] if total else None,
+                total_is_capped=total[1] if total else None,
             ),
         )
 
@@ -1,16 +1,28 @@
 from datetime import datetime, timedelta
-from typing import Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 
 from api.accounts.auth import get_current_active_verified_user
 from api.accounts.models import Account
 from api.database import get_database
-from api.database.aggregations import aggregate_metrics
+from api.database.aggregations import aggregate_metric_series
 from api.database.client import Database
-from api.pagination import PaginatedUsers, Pagination
+from api.pagination import (
+    PaginatedUsers,
+    Pagination,
+    PaginationParams,
+    apply_cursor,
+    count_documents,
+    get_cursor_projection,
+)
 from api.users.validators import parse_user_filter, parse_user_sort
-from api.validators import parse_projection_params, parse_search_params
+from api.validators import (
+    MetricsParams,
+    parse_metrics_params,
+    parse_projection_params,
+    parse_search_params,
+)
+from common.database.aggregations import ACTIVITY_SERIES
 from common.database.models.user import UserMetrics, UserOut
 
 
@@ -33,15 +45,22 @@ def get_users_router(app):
         sort: dict = Depends(parse_user_sort),
         search: dict = Depends(parse_search_params),
         projection: dict = Depends(parse_projection_params),
-        pagination: Tuple[int, int, int] = Depends(pagination.parse_params),
+        pagination: PaginationParams = Depends(pagination.parse_params),
+        count: bool = Query(False, description="Include total count"),
         account: Account = Depends(current_active_verified_user),
         database: Database = Depends(get_database),
     ):
-        offset, limit, max_limit = pagination
+        offset, limit, max_limit, cursor = pagination
 
         if search:
             filter.update(search)
 
+        total = await count_documents(database.users, filter) if count else None
+
+        # keyset pagination: range query on sort key and id after the cursor
+        filter, sort = apply_cursor(filter, sort, cursor)
+        projection = get_cursor_projection(projection, sort)
+
         result = [
             doc
             async for doc in database.users.find(
@@ -53,7 +72,9 @@ def get_users_router(app):
             )
         ]
 
-        return PaginatedUsers.create(data=result, params=pagination)
+        return PaginatedUsers.create(
+            data=result, params=pagination, sort=sort, total=total
+        )
 
     @app.get(
         "/users/{id}",
@@ -65,6 +86,7 @@ def get_users_router(app):
     )
     async def get_user(
         id: int,
+        metrics_params: MetricsParams = Depends(parse_metrics_params),
         account: Account = Depends(current_active_verified_user),
         database: Database = Depends(get_database),
     ):
@@ -73,26 +95,16 @@ def get_users_router(app):
         if not user:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-        activity_total = await aggregate_metrics(
-            database,
-            {"metadata.user_id": id, "metadata.type": "message_posted"},
-            "$sum",
-        )
-
-        yesterday = datetime.utcnow() - timedelta(days=1)
-        activity_last_day = await aggregate_metrics(
+        range_match, resolution, points = metrics_params
+        metrics = await aggregate_metric_series(
             database,
-            {
-                "metadata.user_id": id,
-                "metadata.type": "message_posted",
-                "ts": {"$gte": yesterday},
-            },
-            "$sum",
-        )
-
-        user.metrics = UserMetrics(
-            activity_total=activity_total, activity_last_day=activity_last_day
+            {"metadata.user_id": id, **range_match},
+            ACTIVITY_SERIES,
+            last_day_since=datetime.utcnow() - timedelta(days=1),
+            resolution=resolution,
+            max_points=points,
         )
+        user.metrics = UserMetrics(**metrics)
 
         # find groups user is member of
         filter = {"members.id": user.id}
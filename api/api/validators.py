@@ -1,8 +1,15 @@
 import json
+from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
-from fastapi import Query
+from fastapi import HTTPException, Query, status
+
+from common.database.aggregations import (
+    MAX_METRIC_BUCKETS,
+    MetricResolution,
+    get_bucket_delta,
+)
 
 
 class OrderEnum(str, Enum):
@@ -45,3 +52,82 @@ def parse_projection_params(
 
     # TODO: maybe validate projection dict
     return json.loads(projection)
+
+
+# range (match on "ts"), resolution (automatic if None) and max. number of points
+MetricsParams = Tuple[Dict, Optional[MetricResolution], Optional[int]]
+
+METRIC_RESOLUTION_UNITS = {"m": "minute", "h": "hour", "d": "day", "w": "week"}
+# max. number of buckets of requested resolutions
+MAX_REQUESTED_METRIC_BUCKETS = 10000
+# max. bucket size of requested resolutions
+MAX_REQUESTED_METRIC_BUCKET_DELTA = timedelta(days=366)
+
+
+def to_utc(date: datetime) -> datetime:
+    # dates are stored as naive UTC
+    if date.tzinfo:
+        return date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def check_metric_buckets(
+    start_date: datetime,
+    end_date: Optional[datetime],
+    resolution: MetricResolution,
+) -> None:
+    duration = (end_date or datetime.utcnow()) - start_date
+    if duration / get_bucket_delta(resolution) > MAX_REQUESTED_METRIC_BUCKETS:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            detail="Too many buckets, use a coarser resolution",
+        )
+
+
+def parse_metrics_params(
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    resolution: Optional[str] = Query(
+        None,
+        regex=r"^\d{1,6}[mhdw]$",
+        description="Bucket size, e.g. 15m, 1h, 1d or 1w (automatic if not set)",
+    ),
+    points: Optional[int] = Query(None, ge=2, le=MAX_METRIC_BUCKETS),
+) -> MetricsParams:
+    ts = {}
+    if from_date:
+        ts["$gte"] = to_utc(from_date)
+    if to_date:
+        ts["$lt"] = to_utc(to_date)
+
+    if from_date and to_date and ts["$gte"] >= ts["$lt"]:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, detail='"from" must be before "to"'
+        )
+
+    metric_resolution: Optional[MetricResolution] = None
+    if resolution:
+        bin_size, unit = int(resolution[:-1]), resolution[-1]
+        metric_resolution = (METRIC_RESOLUTION_UNITS[unit], bin_size)  # type: ignore
+
+        if (
+            bin_size < 1
+            or get_bucket_delta(metric_resolution) > MAX_REQUESTED_METRIC_BUCKET_DELTA
+        ):
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST, detail="Invalid resolution"
+            )
+
+        # minutes are grouped from raw metrics, so their range must be limited
+        if unit == "m" and not from_date:
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST,
+                detail='Resolution in minutes requires "from"',
+            )
+
+        # ranges without "from" are checked once their first metric is known (see
+        # "aggregate_metric_series")
+        if from_date:
+            check_metric_buckets(ts["$gte"], ts.get("$lt", None), metric_resolution)
+
+    return ({"ts": ts} if ts else {}), metric_resolution, points
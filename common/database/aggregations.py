@@ -1,103 +1,464 @@
-from datetime import timedelta
-from typing import Dict, List, Literal
+from datetime import datetime, timedelta
+from typing import Dict, List, Literal, Optional, Tuple
+
+import numpy as np
 
 from common.database.models.aggregations import AggregatedMetrics
 
+# series of metrics by name: metric type and accumulator
+MetricSeries = Dict[str, Tuple[str, Literal["$sum", "$avg"]]]
 
-def generate_metrics_aggregation_pipeline(
-    match: Dict,
+ACTIVITY_SERIES: MetricSeries = {"activity": ("message_posted", "$sum")}
+GROWTH_SERIES: MetricSeries = {"growth": ("chat_members_count", "$avg")}
+
+# size of buckets metrics are grouped by: unit and number of units
+MetricUnit = Literal["minute", "hour", "day", "week"]
+MetricResolution = Tuple[MetricUnit, int]
+
+METRIC_UNITS: Dict[str, timedelta] = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+HOURLY: MetricResolution = ("hour", 1)
+
+# resolutions chosen automatically (finest first), minutes are only available on
+# request as they are not pre-aggregated
+AUTO_METRIC_RESOLUTIONS: List[MetricResolution] = [
+    ("hour", 1),
+    ("hour", 3),
+    ("hour", 6),
+    ("hour", 12),
+    ("day", 1),
+    ("week", 1),
+    ("week", 4),
+]
+# max. number of buckets of automatically chosen resolutions
+MAX_METRIC_BUCKETS = 500
+# bins of "$dateTrunc" are counted from this date
+DATE_TRUNC_REFERENCE = datetime(2000, 1, 1)
+
+
+def get_bucket_delta(resolution: MetricResolution) -> timedelta:
+    unit, bin_size = resolution
+    return METRIC_UNITS[unit] * bin_size
+
+
+def get_metric_range(match: Dict) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Get start and end date of a match on metrics ("ts" field), if any.
+    """
+    ts = match.get("ts", {})
+    return ts.get("$gte", ts.get("$gt", None)), ts.get("$lte", ts.get("$lt", None))
+
+
+def get_metric_resolution(
+    start_date: Optional[datetime],
+    end_date: Optional[datetime] = None,
+    max_buckets: int = MAX_METRIC_BUCKETS,
+) -> MetricResolution:
+    """
+    Get the finest resolution returning at most "max_buckets" buckets for a range.
+    """
+    if not start_date:
+        return HOURLY
+
+    duration = (end_date or datetime.utcnow()) - start_date
+
+    for resolution in AUTO_METRIC_RESOLUTIONS:
+        if duration / get_bucket_delta(resolution) <= max_buckets:
+            return resolution
+
+    return AUTO_METRIC_RESOLUTIONS[-1]
+
+
+def generate_metric_bucket_stages(
     accumulator: Literal["$sum", "$avg"],
-    time_delta: timedelta = timedelta(hours=1),
+    resolution: MetricResolution = HOURLY,
+    rollups: bool = True,
 ) -> List:
-    match = {
-        "$match": match,
-    }
-
-    project = {
-        "$project": {
-            "date": {"$dateToParts": {"date": "$ts"}},
-            "value": 1,
-        }
-    }
-
-    group_by_date = {
-        "year": "$date.year",
-        "month": "$date.month",
-        "day": "$date.day",
-        "hour": "$date.hour",
-    }
-
-    group = {
-        "$group": {
-            "_id": {
-                "date": group_by_date,
-            },
-            "value": {accumulator: "$value"},
-        }
-    }
-
-    # TODO: Add minutes option to grou_by_date
-    # if time_delta == timedelta(minutes=1):
-    #     group_by_date["minute"] = "$date.minute"
-
-    format_date = [
-        {"$toString": "$_id.date.year"},
-        "-",
-        {"$toString": "$_id.date.month"},
-        "-",
-        {"$toString": "$_id.date.day"},
-        " ",
-        {"$toString": "$_id.date.hour"},
-        ":00",
+    """
+    Group metric points (raw metrics or hourly rollups) into buckets of a resolution.
+    Results in documents with "date" (start of bucket) and "value" sorted by date.
+    """
+    unit, bin_size = resolution
+
+    if rollups and resolution == HOURLY:
+        # rollups are buckets already
+        stages = []
+        date = "$ts"
+    else:
+        if rollups:
+            accumulators = {"sum": {"$sum": "$sum"}, "count": {"$sum": "$count"}}
+        else:
+            accumulators = {"sum": {"$sum": "$value"}, "count": {"$sum": 1}}
+
+        date_trunc = {"date": "$ts", "unit": unit, "binSize": bin_size}
+        stages = [
+            {"$group": {"_id": {"$dateTrunc": date_trunc}, **accumulators}},
+        ]
+        date = "$_id"
+
+    value = "$sum" if accumulator == "$sum" else {"$divide": ["$sum", "$count"]}
+
+    return [
+        *stages,
+        {
+            "$project": {
+                "_id": 0,  # remove field "_id" from response
+                "date": date,
+                "value": {"$round": [value, 0]},  # round values
+            }
+        },
+        {"$sort": {"date": 1}},  # sort by date ascending
     ]
 
-    # TODO: Add minutes option to format_date
 
-    transform = {
-        "$project": {
-            "_id": 0,  # remove field "_id" from response
-            "date": {"$toDate": {"$concat": format_date}},  # rebuild datetime
-            "value": {"$round": ["$value", 0]},  # round values
+def get_metric_rollup_scope(metadata: Dict) -> List[Dict]:
+    """
+    Get the rollups (scope and key) a metric point is added to.
+    """
+    scopes = [{"scope": "global", "key": 0}]
+
+    if metadata.get("chat_id", None) is not None:
+        scopes.append({"scope": "chat", "key": metadata["chat_id"]})
+    if metadata.get("user_id", None) is not None:
+        scopes.append({"scope": "user", "key": metadata["user_id"]})
+
+    return scopes
+
+
+def truncate_to_hour(date: datetime) -> datetime:
+    return date.replace(minute=0, second=0, microsecond=0)
+
+
+def get_metric_rollup_match(match: Dict) -> Dict:
+    """
+    Translate a match on raw metrics (e.g. {"metadata.chat_id": 1, "metadata.type":
+    "message_posted", "ts": {"$gte": ...}}) into a match on the hourly rollups.
+    """
+    if "metadata.chat_id" in match:
+        rollup_match: Dict = {"scope": "chat", "key": match["metadata.chat_id"]}
+    elif "metadata.user_id" in match:
+        rollup_match = {"scope": "user", "key": match["metadata.user_id"]}
+    else:
+        rollup_match = {"scope": "global", "key": 0}
+
+    if "metadata.type" in match:
+        rollup_match["type"] = match["metadata.type"]
+
+    if "ts" in match:
+        # rollups include the whole hour of the first point
+        rollup_match["ts"] = {
+            operator: truncate_to_hour(date) if operator in ("$gte", "$gt") else date
+            for operator, date in match["ts"].items()
         }
-    }
 
-    sort = {"$sort": {"date": 1}}  # sort by date ascending
+    return rollup_match
+
+
+def generate_metric_series_facet_pipeline(
+    match: Dict,
+    series: MetricSeries,
+    resolution: MetricResolution = HOURLY,
+    last_day_since: Optional[datetime] = None,
+) -> List:
+    """
+    Aggregate multiple series of metrics (e.g. activity and growth of a chat) in
+    a single query. Returns one document with a list of aggregations per series
+    named "<series>_total" and (hourly) "<series>_last_day" if "last_day_since" is
+    given. Reads raw metrics for resolutions finer than the hourly rollups.
+    """
+    rollups = resolution[0] != "minute"
+    type_field = "type" if rollups else "metadata.type"
+
+    series_match = get_metric_rollup_match(match) if rollups else dict(match)
+    series_match[type_field] = {"$in": [type for type, _ in series.values()]}
+
+    total_match: Dict = {}
+    if last_day_since:
+        last_day_range = {"$gte": truncate_to_hour(last_day_since)}
+
+        # the range only applies to the total series, the last day is independent
+        if "ts" in series_match:
+            total_match["ts"] = series_match.pop("ts")
+            series_match["$or"] = [total_match, {"ts": last_day_range}]
+
+    facets = {}
+    for name, (type, accumulator) in series.items():
+        facets[f"{name}_total"] = [
+            {"$match": {type_field: type, **total_match}},
+            *generate_metric_bucket_stages(accumulator, resolution, rollups),
+        ]
 
-    return [match, project, group, transform, sort]
+        if last_day_since:
+            facets[f"{name}_last_day"] = [
+                {"$match": {type_field: type, "ts": last_day_range}},
+                *generate_metric_bucket_stages(accumulator, HOURLY, rollups),
+            ]
+
+    return [{"$match": series_match}, {"$facet": facets}]
+
+
+def truncate_to_bucket(date: datetime, resolution: MetricResolution) -> datetime:
+    """
+    Get the start of the bucket of a date like "$dateTrunc" does (except for weeks,
+    which start on sundays).
+    """
+    delta = get_bucket_delta(resolution)
+    return DATE_TRUNC_REFERENCE + (date - DATE_TRUNC_REFERENCE) // delta * delta
+
+
+def generate_chat_sparklines_pipeline(
+    chat_ids: List[int],
+    type: str,
+    accumulator: Literal["$sum", "$avg"],
+    start_date: datetime,
+    resolution: MetricResolution,
+) -> List:
+    """
+    Aggregate a metric of multiple chats since a date. Returns a document per chat
+    with the dates and values of all buckets containing metrics.
+    """
+    unit, bin_size = resolution
+    value = "$sum" if accumulator == "$sum" else {"$divide": ["$sum", "$count"]}
+
+    return [
+        {
+            "$match": {
+                "scope": "chat",
+                "key": {"$in": chat_ids},
+                "type": type,
+                "ts": {"$gte": start_date},
+            }
+        },
+        {
+            "$group": {
+                "_id": {
+                    "key": "$key",
+                    "date": {
+                        "$dateTrunc": {"date": "$ts", "unit": unit, "binSize": bin_size}
+                    },
+                },
+                "sum": {"$sum": "$sum"},
+                "count": {"$sum": "$count"},
+            }
+        },
+        {
+            "$group": {
+                "_id": "$_id.key",
+                "dates": {"$push": "$_id.date"},
+                "values": {"$push": {"$round": [value, 0]}},
+            }
+        },
+    ]
+
+
+def generate_metric_rollups_rebuild_pipeline(since: datetime) -> List:
+    """
+    Recalculate the rollups of all hours since a date from the raw metrics and merge
+    them into the rollups collection (replacing the incremented values).
+    """
+    return [
+        {"$match": {"ts": {"$gte": truncate_to_hour(since)}}},
+        {
+            "$project": {
+                "ts": {"$dateTrunc": {"date": "$ts", "unit": "hour"}},
+                "type": "$metadata.type",
+                "value": 1,
+                "scopes": [
+                    {"scope": "global", "key": 0},
+                    {"scope": "chat", "key": "$metadata.chat_id"},
+                    {"scope": "user", "key": "$metadata.user_id"},
+                ],
+            }
+        },
+        {"$unwind": "$scopes"},
+        # skip scopes of missing ids (e.g. messages in channels have no user)
+        {"$match": {"scopes.key": {"$ne": None}}},
+        {
+            "$group": {
+                "_id": {
+                    "scope": "$scopes.scope",
+                    "key": "$scopes.key",
+                    "type": "$type",
+                    "ts": "$ts",
+                },
+                "sum": {"$sum": "$value"},
+                "count": {"$sum": 1},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "scope": "$_id.scope",
+                "key": "$_id.key",
+                "type": "$_id.type",
+                "ts": "$_id.ts",
+                "sum": 1,
+                "count": 1,
+            }
+        },
+        {
+            "$merge": {
+                "into": "metrics_hourly",
+                "on": ["scope", "key", "type", "ts"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+
+
+def transform_metric_series(
+    facets: Dict[str, List],
+    series: MetricSeries,
+    resolution: MetricResolution = HOURLY,
+    max_points: Optional[int] = None,
+) -> Dict[str, AggregatedMetrics]:
+    """
+    Transform the result of "generate_metric_series_facet_pipeline" into metrics
+    named like the facets (e.g. "activity_total" and "activity_last_day").
+    Only the total series are downsampled to "max_points".
+    """
+    metrics = {}
+
+    for name, (_, accumulator) in series.items():
+        metrics[f"{name}_total"] = transform_growth_activity_metrics(
+            facets.get(f"{name}_total", []),
+            accumulator,
+            get_bucket_delta(resolution),
+            max_points,
+        )
+
+        if f"{name}_last_day" in facets:
+            metrics[f"{name}_last_day"] = transform_growth_activity_metrics(
+                facets[f"{name}_last_day"], accumulator
+            )
+
+    return metrics
+
+
+def downsample_lttb(values: np.ndarray, group_size: int) -> np.ndarray:
+    """
+    Downsample values to one value per group of "group_size" values using the
+    Largest-Triangle-Three-Buckets algorithm: the value forming the largest triangle
+    with the previously selected value and the mean of the next group is kept, so
+    peaks and drops stay visible. Groups without values (NaN) remain NaN.
+    """
+    group_count = -(-len(values) // group_size)
+    padded = np.full(group_count * group_size, np.nan)
+    padded[: len(values)] = values
+    groups = padded.reshape(group_count, group_size)
+    x = np.arange(len(padded), dtype=float).reshape(group_count, group_size)
+
+    valid = ~np.isnan(groups)
+    valid_counts = valid.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = np.where(valid, x, 0).sum(axis=1) / valid_counts
+        mean_y = np.where(valid, groups, 0).sum(axis=1) / valid_counts
+
+    result = np.full(group_count, np.nan)
+    valid_indexes = np.flatnonzero(~np.isnan(values))
+    if not len(valid_indexes):
+        return result
+
+    # first and last value are anchors of the first and last group
+    anchor_x, anchor_y = float(valid_indexes[0]), values[valid_indexes[0]]
+    last_x, last_y = float(valid_indexes[-1]), values[valid_indexes[-1]]
+
+    for i in range(group_count):
+        if not valid_counts[i]:
+            continue
+
+        # mean of the next group with values
+        next_groups = np.flatnonzero(valid_counts[i + 1 :])
+        if len(next_groups):
+            next_x = mean_x[i + 1 + next_groups[0]]
+            next_y = mean_y[i + 1 + next_groups[0]]
+        else:
+            next_x, next_y = last_x, last_y
+
+        areas = np.abs(
+            (anchor_x - next_x) * (groups[i] - anchor_y)
+            - (anchor_x - x[i]) * (next_y - anchor_y)
+        )
+        selected = int(np.nanargmax(areas))
+
+        result[i] = groups[i][selected]
+        anchor_x, anchor_y = x[i][selected], groups[i][selected]
+
+    return result
+
+
+def downsample_sum(values: np.ndarray, group_size: int) -> np.ndarray:
+    """
+    Downsample values to the sum of each group of "group_size" values (a coarser
+    resolution), so totals are preserved.
+    """
+    group_count = -(-len(values) // group_size)
+    padded = np.zeros(group_count * group_size)
+    padded[: len(values)] = values
+    return padded.reshape(group_count, group_size).sum(axis=1)
+
+
+def transform_sparkline(
+    dates: List[datetime],
+    values: List[float],
+    accumulator: Literal["$sum", "$avg"],
+    start_date: datetime,
+    resolution: MetricResolution,
+    size: int,
+) -> List[Optional[int]]:
+    """
+    Scatter unordered buckets into a series of fixed size starting at "start_date".
+    Gaps are filled with 0 (sums) or None (averages).
+    """
+    data = np.zeros(size) if accumulator == "$sum" else np.full(size, np.nan)
+
+    if dates:
+        offsets = np.array(dates, dtype="datetime64[us]") - np.datetime64(start_date)
+        step = np.timedelta64(int(get_bucket_delta(resolution).total_seconds()), "s")
+        indexes = (offsets // step).astype(np.int64)
+        in_range = (indexes >= 0) & (indexes < size)
+        data[indexes[in_range]] = np.array(values, dtype=float)[in_range]
+
+    return [None if np.isnan(value) else int(value) for value in data]
 
 
 def transform_growth_activity_metrics(
     aggregations,
     accumulator: Literal["$sum", "$avg"],
     time_delta: timedelta = timedelta(hours=1),
+    max_points: Optional[int] = None,
 ) -> AggregatedMetrics:
+    """
+    Transform aggregated buckets into evenly spaced values, filling gaps with 0
+    (sums) or None (averages). With "max_points", values are downsampled to groups
+    of multiple buckets (adjusting "time_delta"): sums are added up, averages are
+    selected with LTTB (see "downsample_lttb").
+    """
     metrics_aggregated = AggregatedMetrics()
 
     if aggregations:
         start_date = aggregations[0]["date"]
         end_date = aggregations[-1]["date"]
 
-        data = []
-        current_date = start_date
-        i = 0
-        while current_date <= end_date:
-            if current_date == aggregations[i]["date"]:
-                new_value = aggregations[i]["value"]
-                i += 1
-            else:
-                new_value = 0 if accumulator == "$sum" else None
-
-            data.append(new_value)
-            current_date += time_delta
+        # index of every bucket relative to start date
+        dates = np.array([doc["date"] for doc in aggregations], dtype="datetime64[us]")
+        step = np.timedelta64(int(time_delta.total_seconds() * 1e6), "us")
+        indexes = ((dates - dates[0]) // step).astype(np.int64)
+        values = np.array([doc["value"] for doc in aggregations], dtype=float)
 
         # fill up data to return at least 24 values (1 day)
-        while len(data) <= 23:
-            new_value = 0 if accumulator == "$sum" else None
-            data.append(new_value)
+        size = max(int(indexes[-1]) + 1, 24)
+        data = np.zeros(size) if accumulator == "$sum" else np.full(size, np.nan)
+        data[indexes] = values
 
         if accumulator == "$sum":
             # sum of all values (e.g. message_posted)
-            metrics_aggregated.sum = sum(filter(None, data))
+            metrics_aggregated.sum = int(np.nansum(values))
 
         if accumulator == "$avg":
             # diff of last and first value (e.g. member_count)
@@ -105,9 +466,19 @@ def transform_growth_activity_metrics(
                 aggregations[-1]["value"] - aggregations[0]["value"]
             )
 
+        if max_points and size > max_points:
+            group_size = -(-size // max_points)
+            if accumulator == "$sum":
+                data = downsample_sum(data, group_size)
+            else:
+                data = downsample_lttb(data, group_size)
+            time_delta = time_delta * group_size
+
         metrics_aggregated.start_date = start_date
         metrics_aggregated.end_date = end_date
         metrics_aggregated.time_delta = int(time_delta.total_seconds())
-        metrics_aggregated.data = data
+        metrics_aggregated.data = [
+            None if np.isnan(value) else int(value) for value in data
+        ]
 
     return metrics_aggregated
@@ -0,0 +1,69 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+from common.database.models.message.attachment import (
+    MessageAttachmentStorageRef,
+    MessageAttachmentType,
+)
+from common.database.models.refs import ChatRef
+
+
+class Attachment(BaseModel):
+    """
+    The model of the attachment index as it is stored in the database (used by the
+    worker). A file is identified by its "file_unique_id" which stays the same when
+    a file is forwarded into other chats. Storage refs and ocr / asr results are
+    reused by all messages containing the same file.
+    """
+
+    id: str  # file_unique_id
+    type: MessageAttachmentType
+    storage_refs: Optional[List[MessageAttachmentStorageRef]] = None
+    ocr: Optional[str] = None
+    transcription: Optional[str] = None
+    # set while ocr / asr of the file is not finished (not reused meanwhile)
+    recognition_pending: Optional[bool] = None
+    # perceptual hash of images and its segments for similarity lookups
+    phash: Optional[str] = None
+    phash_segments: Optional[List[str]] = None
+    # width and height of images
+    image_size: Optional[List[int]] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    # last time the file was uploaded to storage
+    stored_at: datetime = Field(default_factory=datetime.utcnow)
+    # last time a message with this file was scraped
+    last_seen_at: datetime = Field(default_factory=datetime.utcnow)
+
+    class Config:
+        use_enum_values = True
+        allow_population_by_field_name = True
+        fields = {"id": "_id"}
+
+
+class AttachmentMessageRef(BaseModel):
+    id: str
+    chat: ChatRef
+    date: Optional[datetime]
+
+    class Config:
+        allow_population_by_field_name = True
+        fields = {"id": "_id"}
+
+
+class SimilarAttachmentOut(BaseModel):
+    """
+    A visually similar image (by hamming distance of the perceptual hashes) and the
+    messages containing it (used in REST-API).
+    """
+
+    id: str  # file_unique_id
+    type: MessageAttachmentType
+    distance: int
+    ocr: Optional[str] = None
+    storage_refs: Optional[List[MessageAttachmentStorageRef]] = None
+    messages: List[AttachmentMessageRef] = []
+
+    class Config:
+        use_enum_values = True
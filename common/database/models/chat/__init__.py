@@ -34,6 +34,22 @@ class ChatMetrics(BaseModel):
     growth_total: Optional[AggregatedMetrics] = None
 
 
+class ChatSparkline(BaseModel):
+    id: int
+    data: List[Union[int, None]]
+
+
+class ChatSparklines(BaseModel):
+    """
+    A metric of multiple chats, all series share the same buckets.
+    """
+
+    type: str
+    start_date: datetime
+    time_delta: int
+    chats: List[ChatSparkline]
+
+
 class ChatType(str, Enum):
     # we don't save "bot" or "private" chats
     group = "group"
@@ -72,6 +88,8 @@ class Chat(ChatIn):
     members: Optional[List[UserRef]] = None
     members_count: Optional[int]
     metrics: Optional[ChatMetrics] = None
+    # rolling number of messages per detected language
+    language_stats: Optional[Dict[str, int]] = None
     linked_chat: Optional[ChatRef]
     restrictions: Optional[List[dict]]  # TODO: pyrogram_types.Restriction
     permissions: Optional[dict]  # TODO: pyrogram_types.Restriction
@@ -0,0 +1,20 @@
+from datetime import datetime
+from typing import Optional
+
+from common.database.models.chat import GlobalMetrics
+
+
+class Counters(GlobalMetrics):
+    """
+    The model of the materialized global counters as they are stored in the database
+    (used by the worker and the REST-API). Counts are incremented by the scraper and
+    corrected by a periodic reconciliation, which also updates the all-time metrics.
+    """
+
+    id: str = "global"
+    updated_at: Optional[datetime] = None
+    reconciled_at: Optional[datetime] = None
+
+    class Config:
+        allow_population_by_field_name = True
+        fields = {"id": "_id"}
@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseModel
 
@@ -101,3 +101,20 @@ class Metric(BaseModel):
             ts=datetime.utcnow(),
             value=chat.members_count,
         )
+
+
+class MetricRollup(BaseModel):
+    """
+    The model of hourly pre-aggregated metrics per chat, user or globally (key 0).
+    Averages are calculated from "sum" and "count".
+    """
+
+    scope: Literal["chat", "user", "global"]
+    key: int
+    type: MetricType
+    ts: datetime  # start of hour
+    sum: int
+    count: int
+
+    class Config:
+        use_enum_values = True
@@ -1,4 +1,4 @@
-from typing import List, Literal
+from typing import List, Literal, Optional
 
 from pydantic import BaseSettings, validator
 
@@ -16,6 +16,7 @@ class Settings(BaseSettings):
     storage_endpoint: str
     storage_access_key: str
     storage_secret_key: str
+    storage_streaming_enabled: bool = False
 
     # Flower
     flower_host: str
@@ -28,6 +29,10 @@ class Settings(BaseSettings):
     scrape_chats_interval_minutes: int
     save_attachment_types: List[str]
     keep_attachment_files_days: int
+    purge_attachment_files_mode: Literal["task", "lifecycle"] = "task"
+    download_large_file_size_mb: int = 20
+    download_small_files_batch_size: int = 50
+    download_large_files_bandwidth_mb: float = 0
 
     # JWT
     jwt_secret: str
@@ -39,11 +44,20 @@ class Settings(BaseSettings):
     # OCR
     ocr_enabled: bool
     ocr_model_type: Literal["fast", "best", "custom"]
+    ocr_prefilter_enabled: bool = True
 
     # ASR
     asr_enabled: bool
     asr_language: str
     asr_model_name: str
+    asr_model_cache_mb: int = 4096
+    asr_preload_model: bool = False
+    asr_server_address: Optional[str] = None
+    asr_server_timeout_seconds: int = 60
+    asr_vad_enabled: bool = True
+    asr_vad_abort_after_seconds: int = 30
+    asr_parallel_min_seconds: int = 600
+    asr_parallel_workers: int = 0
 
     # API
     api_allow_origins: List[str]
@@ -1,10 +1,14 @@
 from enum import Enum
 
 from minio import Minio
+from minio.commonconfig import ENABLED, Filter
 from minio.error import S3Error
+from minio.lifecycleconfig import Expiration, LifecycleConfig, Rule
 
 from common.settings import settings
 
+EXPIRATION_RULE_ID = "expire-attachments"
+
 
 class StorageBucketNames(str, Enum):
     thumbnails = "thumbnails"  # One size of a photo or a file/sticker thumbnail.
@@ -42,6 +46,38 @@ class Storage:
             if e.code != "BucketAlreadyOwnedByYou":
                 raise e
 
+    def set_expiration(self, bucket: str, days: int) -> bool:
+        """
+        Let the object storage delete attachments after some days. Other lifecycle
+        rules of the bucket are kept. Returns whether the configuration was changed.
+        """
+        config = self.client.get_bucket_lifecycle(bucket)
+        rules = config.rules if config else []
+
+        current_rule = next(
+            (rule for rule in rules if rule.rule_id == EXPIRATION_RULE_ID), None
+        )
+        if (
+            current_rule
+            and current_rule.status == ENABLED
+            and current_rule.expiration
+            and current_rule.expiration.days == days
+        ):
+            return False
+
+        rules = [rule for rule in rules if rule.rule_id != EXPIRATION_RULE_ID]
+        rules.append(
+            Rule(
+                ENABLED,
+                rule_filter=Filter(prefix=""),
+                rule_id=EXPIRATION_RULE_ID,
+                expiration=Expiration(days=days),
+            )
+        )
+        self.client.set_bucket_lifecycle(bucket, LifecycleConfig(rules))
+
+        return True
+
 
 if __name__ == "__main__":
     storage = Storage()
@@ -124,3 +124,24 @@ async def run_pyrogram_method_with_retry_async(
             seconds = cast(int, e.x)  # e.x contains the flood wait timeout
             print(f"Flood exception. Waiting {seconds} seconds")
             await asyncio.sleep(seconds)
+
+
+# perceptual hashes of images are split into segments for multi-index hashing:
+# hashes with a hamming distance below the number of segments share at least one
+# segment, so similar hashes can be looked up by exact segment matches
+IMAGE_HASH_SEGMENTS = 8
+
+
+def get_hash_segments(image_hash: str) -> List[str]:
+    """
+    Split a hex hash into segments prefixed with their position e.g. "0:9f3a".
+    """
+    size = len(image_hash) // IMAGE_HASH_SEGMENTS
+    return [
+        f"{i}:{image_hash[i * size : (i + 1) * size]}"
+        for i in range(IMAGE_HASH_SEGMENTS)
+    ]
+
+
+def hamming_distance(hash_a: str, hash_b: str) -> int:
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
@@ -51,6 +51,18 @@ let res = [
     "forward.from_chat._id": 1,
     "forward.from_user._id": 1,
   }),
+  db.messages.createIndex(
+    { "attachment.raw.file_unique_id": 1 },
+    { sparse: true }
+  ),
+
+  db.attachments.createIndex({
+    stored_at: 1,
+  }),
+  db.attachments.createIndex(
+    { phash_segments: 1 }, // multikey index for similar image lookups
+    { sparse: true }
+  ),
 
   db.users.createIndex(
     {
@@ -79,6 +91,11 @@ let res = [
       granularity: "seconds",
     },
   }),
+  // hourly rollups of metrics, unique index is required by "$merge"
+  db.metrics_hourly.createIndex(
+    { scope: 1, key: 1, type: 1, ts: 1 },
+    { unique: true }
+  ),
 ];
 
 printjson(res);
@@ -1,27 +1,142 @@
-from datetime import timedelta
-from typing import Dict, Literal
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import OperationFailure
 
 from common.database.aggregations import (
-    generate_metrics_aggregation_pipeline,
-    transform_growth_activity_metrics,
+    MetricResolution,
+    MetricSeries,
+    generate_metric_rollups_rebuild_pipeline,
+    generate_metric_series_facet_pipeline,
+    get_metric_range,
+    get_metric_resolution,
+    get_metric_rollup_match,
+    get_metric_rollup_scope,
+    transform_metric_series,
+    truncate_to_hour,
 )
 from common.database.models.aggregations import AggregatedMetrics
 from worker.database import Database
 
+# unique index of the hourly rollups, needed by "$merge" and the upserts of increments
+METRIC_ROLLUPS_INDEX = [
+    ("scope", ASCENDING),
+    ("key", ASCENDING),
+    ("type", ASCENDING),
+    ("ts", ASCENDING),
+]
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+
+def get_resolution(
+    database: Database, match: Dict, types: List[str]
+) -> MetricResolution:
+    """
+    Choose a resolution for the range of a match. Ranges without start date begin
+    with the first rollup.
+    """
+    start_date, end_date = get_metric_range(match)
+
+    if not start_date:
+        first_rollup = database.metrics_hourly.find_one(
+            {**get_metric_rollup_match(match), "type": {"$in": types}},
+            {"ts": 1},
+            sort=[("ts", 1)],
+        )
+        start_date = first_rollup.ts if first_rollup else None
+
+    return get_metric_resolution(start_date, end_date)
 
-def aggregate_metrics(
+
+def aggregate_metric_series(
     database: Database,
     match: Dict,
-    accumulator: Literal["$sum", "$avg"],
-    time_delta: timedelta = timedelta(hours=1),
-) -> AggregatedMetrics:
+    series: MetricSeries,
+    last_day_since: Optional[datetime] = None,
+    resolution: Optional[MetricResolution] = None,
+    max_points: Optional[int] = None,
+) -> Dict[str, AggregatedMetrics]:
+    """
+    Aggregate all series in a single query (see "transform_metric_series").
+    """
+    if not resolution:
+        types = [type for type, _ in series.values()]
+        resolution = get_resolution(database, match, types)
+
+    pipeline = generate_metric_series_facet_pipeline(
+        match, series, resolution, last_day_since
+    )
 
-    pipeline = generate_metrics_aggregation_pipeline(match, accumulator, time_delta)
+    # minutes are not pre-aggregated
+    if resolution[0] == "minute":
+        collection = database.metrics
+    else:
+        collection = database.metrics_hourly
 
-    aggregations = [doc for doc in database.metrics.aggregate(pipeline)]
+    facets = [doc for doc in collection.aggregate(pipeline)]
 
-    metrics_aggregated = transform_growth_activity_metrics(
-        aggregations, accumulator, time_delta
+    return transform_metric_series(
+        facets[0] if facets else {}, series, resolution, max_points
     )
 
-    return metrics_aggregated
+
+def increment_metric_rollups(database: Database, metrics: List[Dict]) -> None:
+    """
+    Add new metric points to the hourly rollups.
+    """
+    increments: Dict[Tuple, List[int]] = {}
+
+    for metric in metrics:
+        type = metric["metadata"]["type"]
+        hour = truncate_to_hour(metric["ts"])
+        for scope in get_metric_rollup_scope(metric["metadata"]):
+            increment = increments.setdefault(
+                (scope["scope"], scope["key"], type, hour), [0, 0]
+            )
+            increment[0] += metric["value"]
+            increment[1] += 1
+
+    if not increments:
+        return
+
+    database.metrics_hourly.bulk_write(
+        [
+            UpdateOne(
+                {"scope": scope, "key": key, "type": type, "ts": ts},
+                {"$inc": {"sum": value_sum, "count": count}},
+                upsert=True,
+            )
+            for (scope, key, type, ts), (value_sum, count) in increments.items()
+        ],
+        ordered=False,
+    )
+
+
+def rebuild_metric_rollups(database: Database, since: datetime) -> None:
+    """
+    Recalculate the rollups since a date from the raw metrics, e.g. for metrics
+    saved before the rollups existed or to correct failed increments.
+    """
+    pipeline = generate_metric_rollups_rebuild_pipeline(since)
+
+    # the pipeline writes to the rollups collection with "$merge"
+    for _ in database.metrics.aggregate(pipeline):
+        pass
+
+
+def create_metric_rollups_index(database: Database) -> bool:
+    """
+    Create the unique index of the rollups (does nothing if it exists). Returns
+    False if the rollups contain duplicates, which prevent the index.
+    """
+    try:
+        database.metrics_hourly.collection.create_index(
+            METRIC_ROLLUPS_INDEX, unique=True
+        )
+    except OperationFailure as error:
+        if error.code != DUPLICATE_KEY_ERROR_CODE:
+            raise
+        return False
+
+    return True
@@ -0,0 +1,90 @@
+"""
+Shared speech recognition server. Loads vosk models once and recognizes audio
+streamed by the process workers, so big models don't have to be loaded by every
+worker process (see setting "ASR_SERVER_ADDRESS").
+
+Protocol: the client sends a JSON header line '{"model": "<model name>"}' followed
+by 16-bit mono PCM audio and closes its writing side of the connection. The server
+responds with a JSON line, either '{"text": "..."}' or '{"error": "..."}'.
+
+Usage: python -m worker.asr_server [host:port | /path/to/socket]
+"""
+
+import json
+import logging
+import os
+import socketserver
+import sys
+
+from common.settings import settings
+from worker.tasks.process.utils.speech_recognition import (
+    model_registry,
+    recognize_pcm,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def is_valid_model_name(model_name: str) -> bool:
+    # model names are used as directory names
+    return bool(model_name) and "/" not in model_name and ".." not in model_name
+
+
+class RecognitionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            header = json.loads(self.rfile.readline())
+            model_name = header.get("model", settings.asr_model_name)
+
+            if not is_valid_model_name(model_name):
+                raise ValueError(f"Invalid model name '{model_name}'")
+
+            model = model_registry.get(model_name)
+            if not model:
+                raise ValueError(f"Model '{model_name}' not available")
+
+            text, duration = recognize_pcm(self.rfile.read, model)
+            logger.info(f"Recognized {round(duration)}s audio using '{model_name}'")
+            response = {"text": text}
+        except Exception as e:
+            logger.error("Speech recognition failed", exc_info=True)
+            response = {"error": str(e)}
+
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class ThreadingUnixStreamServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+
+def create_server(address: str) -> socketserver.BaseServer:
+    # address is either a path to a unix socket or "host:port"
+    if address.startswith("/"):
+        if os.path.exists(address):
+            os.remove(address)
+        return ThreadingUnixStreamServer(address, RecognitionHandler)
+
+    host, port = address.rsplit(":", 1)
+    return ThreadingTCPServer((host, int(port)), RecognitionHandler)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    address = sys.argv[1] if len(sys.argv) > 1 else settings.asr_server_address
+    if not address:
+        sys.exit("No address given (argument or setting ASR_SERVER_ADDRESS)")
+
+    # load default model before accepting connections
+    model_registry.get(settings.asr_model_name)
+
+    with create_server(address) as server:
+        logger.info(f"ASR server listening on {address}")
+        server.serve_forever()
@@ -0,0 +1,194 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Union
+
+from pymongo import UpdateOne
+
+from common.database.models.attachment import Attachment
+from common.settings import settings
+from common.utils import get_hash_segments
+from worker.database import Database
+
+
+def get_file_unique_id(message: Union[dict, object]) -> Union[str, None]:
+    attachment = (
+        message.get("attachment", None)
+        if isinstance(message, dict)
+        else getattr(message, "attachment", None)
+    )
+
+    if not attachment or not attachment.get("raw", None):
+        return None
+
+    return attachment["raw"].get("file_unique_id", None)
+
+
+def find_indexed_attachments(
+    database: Database, file_unique_ids: List[str]
+) -> Dict[str, Attachment]:
+    """
+    Get attachments that are already in storage by their "file_unique_id".
+    """
+    if not file_unique_ids:
+        return {}
+
+    query: dict = {
+        "_id": {"$in": list(set(file_unique_ids))},
+        "storage_refs": {"$exists": True},
+        # messages reusing the file would miss the ocr / asr results
+        "recognition_pending": {"$ne": True},
+    }
+
+    # skip files that will soon expire in storage (by bucket lifecycle rules)
+    if (
+        settings.purge_attachment_files_mode == "lifecycle"
+        and settings.keep_attachment_files_days > 0
+    ):
+        query["stored_at"] = {
+            "$gt": datetime.utcnow()
+            - timedelta(days=settings.keep_attachment_files_days - 1)
+        }
+
+    return {
+        attachment.id: attachment
+        for attachment in database.attachments.find(query)
+    }
+
+
+def reuse_indexed_attachments(database: Database, messages: List) -> List:
+    """
+    Copy storage refs and ocr / asr results of indexed attachments to the messages
+    containing the same file. Returns the messages that still need to be downloaded.
+    """
+    indexed_attachments = find_indexed_attachments(
+        database, [id for id in map(get_file_unique_id, messages) if id]
+    )
+
+    if not indexed_attachments:
+        return messages
+
+    remaining_messages = []
+    requests = []
+
+    for message in messages:
+        attachment = indexed_attachments.get(get_file_unique_id(message), None)
+
+        if not attachment:
+            remaining_messages.append(message)
+            continue
+
+        save_data: dict = {
+            "attachment.storage_refs": [
+                dict(ref) for ref in attachment.storage_refs or []
+            ]
+        }
+        if attachment.ocr:
+            save_data["attachment.ocr"] = attachment.ocr
+        if attachment.transcription:
+            save_data["attachment.transcription"] = attachment.transcription
+
+        message_id = message["_id"] if isinstance(message, dict) else message.id
+        requests.append(UpdateOne({"_id": message_id}, {"$set": save_data}))
+
+    if requests:
+        database.messages.bulk_write(requests, ordered=False)
+
+    # keep files of recently scraped messages when purging old attachments
+    database.attachments.update_many(
+        {"_id": {"$in": list(indexed_attachments.keys())}},
+        {"$set": {"last_seen_at": datetime.utcnow()}},
+    )
+
+    return remaining_messages
+
+
+def find_identical_image(
+    database: Database, phash: str, image_size: List[int]
+) -> Union[Attachment, None]:
+    """
+    Get an image with ocr results and the same perceptual hash and size, e.g. a
+    re-encoded copy. Similar (not identical) hashes aren't used, as images with the
+    same layout but different text (screenshots, memes) have similar hashes.
+    """
+    return database.attachments.find_one(
+        {
+            # exact hash match, the first segment is indexed
+            "phash_segments": get_hash_segments(phash)[0],
+            "phash": phash,
+            "image_size": image_size,
+            "ocr": {"$exists": True},
+        },
+        {"_id": 1, "ocr": 1},
+    )
+
+
+def index_attachment(
+    database: Database,
+    file_unique_id: str,
+    attachment_type: str,
+    storage_refs: List[dict],
+    ocr: Optional[str] = None,
+    transcription: Optional[str] = None,
+    phash: Optional[str] = None,
+    image_size: Optional[List[int]] = None,
+    recognition_pending: bool = False,
+) -> None:
+    datetime_now = datetime.utcnow()
+    save_data: dict = {
+        "type": attachment_type,
+        "storage_refs": storage_refs,
+        "stored_at": datetime_now,
+        "last_seen_at": datetime_now,
+    }
+
+    if ocr:
+        save_data["ocr"] = ocr
+    if transcription:
+        save_data["transcription"] = transcription
+    if phash:
+        save_data["phash"] = phash
+        save_data["phash_segments"] = get_hash_segments(phash)
+    if image_size:
+        save_data["image_size"] = image_size
+
+    update: dict = {"$set": save_data, "$setOnInsert": {"created_at": datetime_now}}
+    if recognition_pending:
+        save_data["recognition_pending"] = True
+    else:
+        update["$unset"] = {"recognition_pending": 1}
+
+    database.attachments.update_one({"_id": file_unique_id}, update, upsert=True)
+
+
+def update_indexed_attachment(
+    database: Database,
+    file_unique_id: str,
+    ocr: Optional[str] = None,
+    transcription: Optional[str] = None,
+) -> None:
+    """
+    Save ocr / asr results of an attachment indexed by the upload stage and mark
+    the recognition as finished. The results are also saved to other messages with
+    the same file, which got the storage refs before the recognition finished.
+    """
+    save_data: dict = {}
+
+    if ocr:
+        save_data["ocr"] = ocr
+    if transcription:
+        save_data["transcription"] = transcription
+
+    update: dict = {"$unset": {"recognition_pending": 1}}
+    if save_data:
+        update["$set"] = save_data
+
+    database.attachments.update_one({"_id": file_unique_id}, update)
+
+    for field, value in save_data.items():
+        database.messages.update_many(
+            {
+                "attachment.raw.file_unique_id": file_unique_id,
+                "attachment.storage_refs": {"$exists": True},
+                f"attachment.{field}": {"$exists": False},
+            },
+            {"$set": {f"attachment.{field}": value}},
+        )
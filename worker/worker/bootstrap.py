@@ -0,0 +1,138 @@
+import importlib
+import json
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from celery.utils.log import get_logger
+
+from common.settings import settings
+
+logger = get_logger(__name__)
+
+# workers write a file named by their hostname once they are ready to consume tasks
+READY_PATH = Path.cwd().joinpath("tmp", "ready")
+
+
+def prefetch_ocr_models() -> None:
+    if not settings.ocr_enabled:
+        return
+
+    from worker.tasks.process.utils.text_recognition import (
+        ensure_model_file,
+        get_tesseract_language,
+    )
+
+    language = get_tesseract_language(settings.ocr_asr_fallback_language)
+    if language:
+        ensure_model_file(language, settings.ocr_model_type)
+
+
+def prefetch_asr_models() -> None:
+    # models are loaded by the asr server instead
+    if not settings.asr_enabled or settings.asr_server_address:
+        return
+
+    from worker.tasks.process.utils.speech_recognition import (
+        download_model_speech_recognition,
+    )
+
+    download_model_speech_recognition(settings.asr_model_name)
+
+
+def set_storage_expiration() -> None:
+    # let the object storage delete expired attachments
+    if (
+        settings.purge_attachment_files_mode != "lifecycle"
+        or settings.keep_attachment_files_days == 0
+    ):
+        return
+
+    from common.storage import Storage, StorageBucketNames
+
+    storage = Storage()
+    for bucket in StorageBucketNames:
+        if storage.set_expiration(bucket.value, settings.keep_attachment_files_days):
+            logger.info(f"Set expiration of storage bucket '{bucket.value}'")
+
+
+def prepare_metric_rollups() -> None:
+    from worker import tasks
+    from worker.aggregations import create_metric_rollups_index
+    from worker.database import Database
+
+    database = Database()
+
+    try:
+        if not create_metric_rollups_index(database):
+            # rollups are derived from the raw metrics, so they can be rebuilt
+            logger.warning("Dropping metric rollups with duplicates")
+            database.metrics_hourly.collection.drop()
+            create_metric_rollups_index(database)
+
+        # fill the rollups with existing metrics once, e.g. after upgrading
+        if database.metrics_hourly.collection.find_one() is None and (
+            database.metrics.collection.find_one() is not None
+        ):
+            tasks.rebuild_metric_rollups.s(days=0).apply_async()
+            logger.info("Scheduled rebuild of all metric rollups")
+    finally:
+        database.close()
+
+
+# modules imported and models prefetched (or other setup done once) before a worker
+# consumes a queue, all other heavy dependencies are imported by the tasks when
+# they are needed
+QUEUE_PROFILES: Dict[str, dict] = {
+    "scraping": {"modules": ["gcld3"], "prefetch": [prepare_metric_rollups]},
+    "files": {"modules": [], "prefetch": [set_storage_expiration]},
+    "process": {"modules": ["PIL.Image"], "prefetch": []},
+    "ocr": {
+        "modules": ["worker.tasks.process.utils.text_recognition"],
+        "prefetch": [prefetch_ocr_models],
+    },
+    "asr": {
+        "modules": ["worker.tasks.process.utils.speech_recognition"],
+        "prefetch": [prefetch_asr_models],
+    },
+}
+
+
+def bootstrap_queues(queues: List[str]) -> None:
+    """
+    Import the modules and prefetch the models needed by the consumed queues, so
+    they are not imported or downloaded during the first task.
+    """
+    start_time = time.time()
+
+    for queue in queues:
+        profile = QUEUE_PROFILES.get(queue, None)
+        if not profile:
+            continue
+
+        for module in profile["modules"]:
+            importlib.import_module(module)
+
+        prefetch: Callable[[], None]
+        for prefetch in profile["prefetch"]:
+            try:
+                prefetch()
+            except Exception:
+                logger.error(f"Failed preparing queue '{queue}'", exc_info=True)
+
+    end_time = round(time.time() - start_time, 2)
+    logger.info(f"Bootstrap of queues {queues} took {end_time} s")
+
+
+def set_ready(hostname: str, queues: List[str]) -> None:
+    READY_PATH.mkdir(parents=True, exist_ok=True)
+    READY_PATH.joinpath(hostname).write_text(
+        json.dumps({"queues": queues, "ready_at": time.time()})
+    )
+    logger.info(f"Worker '{hostname}' ready for queues {queues}")
+
+
+def unset_ready(hostname: str) -> None:
+    ready_file = READY_PATH.joinpath(hostname)
+    if ready_file.is_file():
+        ready_file.unlink()
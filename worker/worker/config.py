@@ -6,13 +6,19 @@ from common.settings import settings
 
 broker_url = "redis://redis:6379/0"
 result_backend = "redis://redis:6379/0"
-imports = ["worker.tasks"]
+imports = ["worker.tasks", "worker.signals"]
 
 # careful: maps task names set in @task decorator
 task_routes = {
     "scraping.*": {"queue": "scraping"},
+    "metrics.*": {"queue": "scraping"},
+    # large files have their own queue so they don't block small files
+    "files.download_large_message_attachment": {"queue": "files-large"},
     "files.*": {"queue": "files"},
     "process.*": {"queue": "process"},
+    # recognition stages scale independently from uploads
+    "ocr.*": {"queue": "ocr"},
+    "asr.*": {"queue": "asr"},
 }
 
 # task_annotations = {'files.download_message_attachments': {'rate_limit': '3/m'}}
@@ -30,6 +36,14 @@ beat_schedule = {
         "task": "scraping.scrape_chat_members",
         "schedule": crontab(hour=3, minute=0),  # execute daily
     },
+    "reconcile-counters": {
+        "task": "metrics.reconcile_counters",
+        "schedule": timedelta(hours=1),
+    },
+    "rebuild-metric-rollups": {
+        "task": "metrics.rebuild_metric_rollups",
+        "schedule": crontab(hour=2, minute=0),  # execute daily
+    },
 }
 
 if settings.save_attachment_types and settings.keep_attachment_files_days > 0:
@@ -0,0 +1,72 @@
+from datetime import datetime
+from typing import Dict, List
+
+from common.database.aggregations import ACTIVITY_SERIES, GROWTH_SERIES
+from common.database.models.counters import Counters
+from worker.aggregations import aggregate_metric_series
+from worker.database import Database
+
+COUNTERS_ID = "global"
+
+# counters per collection of scraping results
+COLLECTION_COUNTERS = {
+    "users": "users_count",
+    "chats": "chats_count",
+    "messages": "messages_count",
+}
+ATTACHMENT_TYPE_COUNTERS = {
+    "photo": "photos_count",
+    "video": "videos_count",
+    "voice": "voices_count",
+}
+
+
+def increment_counters(database: Database, key: str, documents: List[Dict]) -> None:
+    if key not in COLLECTION_COUNTERS or not documents:
+        return
+
+    increments = {COLLECTION_COUNTERS[key]: len(documents)}
+
+    if key == "messages":
+        for doc in documents:
+            attachment_type = (doc.get("attachment", None) or {}).get("type", None)
+            counter = ATTACHMENT_TYPE_COUNTERS.get(attachment_type, None)
+            if counter:
+                increments[counter] = increments.get(counter, 0) + 1
+
+    database.counters.update_one(
+        {"_id": COUNTERS_ID},
+        {"$inc": increments, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+def reconcile_counters(database: Database) -> Counters:
+    """
+    Count all documents to correct drift of the incremented counters and aggregate
+    the all-time metrics.
+    """
+    counts = {
+        counter: getattr(database, collection).count_documents({})
+        for collection, counter in COLLECTION_COUNTERS.items()
+    }
+    for attachment_type, counter in ATTACHMENT_TYPE_COUNTERS.items():
+        counts[counter] = database.messages.count_documents(
+            {"attachment.type": attachment_type}
+        )
+
+    datetime_now = datetime.utcnow()
+    counters = Counters(
+        **counts,
+        **aggregate_metric_series(database, {}, {**ACTIVITY_SERIES, **GROWTH_SERIES}),
+        updated_at=datetime_now,
+        reconciled_at=datetime_now,
+    )
+
+    database.counters.update_one(
+        {"_id": COUNTERS_ID},
+        {"$set": counters.dict(exclude={"id"}, exclude_none=True)},
+        upsert=True,
+    )
+
+    return counters
@@ -3,16 +3,25 @@ from typing import Dict, Generic, Iterator, Type, TypeVar, Union
 from pymongo import MongoClient
 from pymongo.database import Collection as PyMongoCollection
 from pymongo.database import Database as PyMongoDatabase
-from pymongo.results import BulkWriteResult, InsertOneResult, UpdateResult
-
+from pymongo.results import (
+    BulkWriteResult,
+    DeleteResult,
+    InsertOneResult,
+    UpdateResult,
+)
+
+from common.database.models.attachment import Attachment
 from common.database.models.chat import Chat
 from common.database.models.client import Client
+from common.database.models.counters import Counters
 from common.database.models.message import Message
-from common.database.models.metric import Metric
+from common.database.models.metric import Metric, MetricRollup
 from common.database.models.user import User
 from common.settings import settings
 
-T = TypeVar("T", Client, Chat, Message, User, Metric)
+T = TypeVar(
+    "T", Client, Chat, Message, User, Metric, MetricRollup, Attachment, Counters
+)
 
 
 class Collection(Generic[T]):
@@ -62,6 +71,15 @@ class Collection(Generic[T]):
     def insert_one(self, *args, **kwargs) -> InsertOneResult:
         return self.collection.insert_one(*args, **kwargs)
 
+    def update_many(self, *args, **kwargs) -> UpdateResult:
+        return self.collection.update_many(*args, **kwargs)
+
+    def delete_many(self, *args, **kwargs) -> DeleteResult:
+        return self.collection.delete_many(*args, **kwargs)
+
+    def count_documents(self, *args, **kwargs) -> int:
+        return self.collection.count_documents(*args, **kwargs)
+
 
 class ClientsCollection(Collection[Client]):
     name = "clients"
@@ -88,6 +106,21 @@ class MetricsCollection(Collection[Metric]):
     model = Metric
 
 
+class MetricRollupsCollection(Collection[MetricRollup]):
+    name = "metrics_hourly"
+    model = MetricRollup
+
+
+class AttachmentsCollection(Collection[Attachment]):
+    name = "attachments"
+    model = Attachment
+
+
+class CountersCollection(Collection[Counters]):
+    name = "counters"
+    model = Counters
+
+
 class Database:
     def __init__(self, connect=True) -> None:
         if connect:
@@ -107,6 +140,9 @@ class Database:
         self.messages = MessagesCollection(self.__db)
         self.users = UsersCollection(self.__db)
         self.metrics = MetricsCollection(self.__db)
+        self.metrics_hourly = MetricRollupsCollection(self.__db)
+        self.attachments = AttachmentsCollection(self.__db)
+        self.counters = CountersCollection(self.__db)
 
     def __get_database(self) -> PyMongoDatabase:
         return self.__client[settings.mongo_db_name]
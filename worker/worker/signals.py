@@ -0,0 +1,53 @@
+from typing import List
+
+from celery.signals import (
+    celeryd_after_setup,
+    worker_process_init,
+    worker_ready,
+    worker_shutdown,
+)
+from celery.utils.log import get_logger
+
+from common.settings import settings
+from worker.bootstrap import bootstrap_queues, set_ready, unset_ready
+from worker.main import app
+
+logger = get_logger(__name__)
+
+
+def get_consumed_queues() -> List[str]:
+    # queues selected with "--queues" (all queues if not set)
+    consume_from = app.amqp.queues.consume_from
+    return list(consume_from.keys() if consume_from else app.amqp.queues.keys())
+
+
+@celeryd_after_setup.connect
+def bootstrap_worker(sender, instance, **kwargs):
+    # runs in the main process, so child processes inherit the imported modules
+    bootstrap_queues(get_consumed_queues())
+
+
+@worker_ready.connect
+def report_ready(sender, **kwargs):
+    set_ready(sender.hostname, get_consumed_queues())
+
+
+@worker_shutdown.connect
+def report_shutdown(sender, **kwargs):
+    unset_ready(sender.hostname)
+
+
+@worker_process_init.connect
+def preload_models(**kwargs):
+    if (
+        settings.asr_enabled
+        and settings.asr_preload_model
+        # models are loaded by the asr server instead
+        and not settings.asr_server_address
+        and "asr" in get_consumed_queues()
+    ):
+        # defer import, only asr workers need vosk
+        from worker.tasks.process.utils.speech_recognition import model_registry
+
+        logger.info(f"Preloading speech recognition model '{settings.asr_model_name}'")
+        model_registry.get(settings.asr_model_name)
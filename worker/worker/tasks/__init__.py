@@ -1,6 +1,15 @@
-from .files.download_message_attachments import download_message_attachments
+from .files.download_message_attachments import (
+    download_large_message_attachment,
+    download_message_attachments,
+)
 from .files.purge_message_attachments import purge_message_attachments
-from .process.process_attachments import process_attachments
+from .metrics.rebuild_metric_rollups import rebuild_metric_rollups
+from .metrics.reconcile_counters import reconcile_counters
+from .process.process_attachments import process_attachments, upload_attachment
+from .process.recognize_attachment import (
+    recognize_attachment_speech,
+    recognize_attachment_text,
+)
 from .scraping.init_scrapers import init_scrapers
 from .scraping.scrape_chat_members import scrape_chat_members
 from .scraping.scrape_chats import scrape_chats
@@ -10,6 +19,12 @@ __all__ = [
     "scrape_chats",
     "scrape_chat_members",
     "download_message_attachments",
+    "download_large_message_attachment",
     "purge_message_attachments",
     "process_attachments",
+    "upload_attachment",
+    "recognize_attachment_text",
+    "recognize_attachment_speech",
+    "reconcile_counters",
+    "rebuild_metric_rollups",
 ]
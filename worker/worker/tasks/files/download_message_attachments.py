@@ -1,8 +1,7 @@
 import asyncio
-
-# import time
+import time
 from pathlib import Path
-from typing import List, Union, cast
+from typing import Awaitable, Callable, Dict, List, Union, cast
 
 import celery
 from celery.utils.log import get_task_logger
@@ -12,11 +11,20 @@ from pyrogram.client import Client as TelegramClient
 from common.database.models.message import Message
 from common.database.models.pyobjectid import PyObjectId
 from common.settings import settings
-from common.storage import StorageBucketNames
+from common.storage import Storage, StorageBucketNames
 from common.utils import run_pyrogram_method_with_retry_async
 from worker import tasks
+from worker.attachments import get_file_unique_id, reuse_indexed_attachments
 from worker.database import Database
 from worker.main import app
+from worker.tasks.files.utils.resumable_download import (
+    download_file_resumable,
+    remove_stale_partial_files,
+)
+from worker.tasks.files.utils.stream_upload import (
+    get_file_extension,
+    stream_file_to_storage,
+)
 
 logger = get_task_logger(__name__)
 TMP_PATH = Path().cwd().joinpath("tmp")
@@ -26,11 +34,35 @@ def run_process_task(attachments: List):
     tasks.process_attachments.s(attachments=attachments).apply_async()
 
 
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+
 def show_progress(current, total):
     if total > 0:
         logger.debug(f"{current * 100 / total:.1f}%")
 
 
+def create_progress_callback(max_bytes_per_second: float = 0) -> ProgressCallback:
+    """
+    Create a progress callback for a single file download that sleeps in between
+    chunks to keep the average download rate within the bandwidth budget.
+    """
+    start_time = time.monotonic()
+
+    # Note: must be a coroutine function to be awaited by pyrogram
+    async def progress(current: int, total: int) -> None:
+        show_progress(current, total)
+
+        if max_bytes_per_second <= 0:
+            return
+
+        wait_seconds = current / max_bytes_per_second - (time.monotonic() - start_time)
+        if wait_seconds > 0:
+            await asyncio.sleep(wait_seconds)
+
+    return progress
+
+
 def is_image_file(attachment):
     return attachment["type"] == "photo" or (
         attachment["type"] == "document"
@@ -53,6 +85,7 @@ async def download_file_from_telegram(
     tg_message_or_file_id: Union[str, pyrogram_types.Message],
     tmp_dir: str,
     tg_client: TelegramClient,
+    progress: ProgressCallback,
 ) -> Union[str, None]:
     try:
         return cast(
@@ -62,7 +95,7 @@ async def download_file_from_telegram(
                 tg_client.download_media,
                 tg_message_or_file_id,
                 tmp_dir,
-                progress=show_progress,
+                progress=progress,
             ),
         )
     except Exception:
@@ -119,7 +152,11 @@ async def move_to_downloads_dir(
 
 
 async def download_message_attachments_async(
-    task: celery.Task, client_id: str, message_ids: List[str]
+    task: celery.Task,
+    client_id: str,
+    message_ids: List[str],
+    max_bytes_per_second: float = 0,
+    resumable: bool = False,
 ) -> dict:
     if not client_id or not message_ids:
         raise ValueError("Invalid task arguments")
@@ -130,6 +167,7 @@ async def download_message_attachments_async(
         )
 
     database = Database()
+    storage = Storage() if settings.storage_streaming_enabled else None
     downloaded_attachments = []
 
     # get client doc from database
@@ -170,12 +208,29 @@ async def download_message_attachments_async(
             {"_id": 1, "attachment": 1, "message_id": 1, "chat": 1, "language": 1},
         )
     )
+
+    # skip files that have been downloaded for other messages in the meantime
+    db_messages = reuse_indexed_attachments(database, db_messages)
     database.close()
 
+    # download files only once if the same file is attached to multiple messages
+    duplicate_message_ids: Dict[str, List[str]] = {}
+    unique_messages = []
+    for message in db_messages:
+        file_unique_id = get_file_unique_id(message)
+
+        if file_unique_id and file_unique_id in duplicate_message_ids:
+            duplicate_message_ids[file_unique_id].append(message.id)
+            continue
+        if file_unique_id:
+            duplicate_message_ids[file_unique_id] = []
+
+        unique_messages.append(message)
+
     logger.info(f"Initializing Telegram client '{db_client_doc.title}'")
 
     async with tg_client:
-        for message in db_messages:
+        for message in unique_messages:
 
             attachment = cast(dict, message.attachment)
             chat = cast(dict, message.chat)
@@ -220,19 +275,59 @@ async def download_message_attachments_async(
 
             logger.info(f"Start downloading {attachment['type'].upper()}")
 
-            file_path = await download_file_from_telegram(
-                tg_message, session_dir_with_slash, tg_client
-            )
+            if storage:
+                # stream file into object storage (skip tmp directory)
+                file_name = attachment["raw"]["file_unique_id"] + get_file_extension(
+                    attachment["type"], attachment["raw"]
+                )
+                bucket_name = bucket_name_from_attachment_type(attachment["type"])
+
+                if not await stream_file_to_storage(
+                    tg_message,
+                    bucket_name,
+                    file_name,
+                    tg_client,
+                    storage,
+                    create_progress_callback(max_bytes_per_second),
+                ):
+                    continue
 
-            if not file_path:
-                continue
+                logger.info(f"Streamed {attachment['type'].upper()} to storage")
+            else:
+                if resumable:
+                    # keep partial file and chunk map if download fails (for retries)
+                    partial_file_name = attachment["raw"][
+                        "file_unique_id"
+                    ] + get_file_extension(attachment["type"], attachment["raw"])
+                    file_path = await download_file_resumable(
+                        tg_message,
+                        TMP_PATH.joinpath("partials", partial_file_name),
+                        tg_client,
+                        attachment["raw"].get("file_size", None) or 0,
+                        create_progress_callback(max_bytes_per_second),
+                    )
+                else:
+                    file_path = await download_file_from_telegram(
+                        tg_message,
+                        session_dir_with_slash,
+                        tg_client,
+                        create_progress_callback(max_bytes_per_second),
+                    )
+
+                if not file_path:
+                    continue
 
-            path_new = await move_to_downloads_dir(
-                attachment["type"], attachment["raw"]["file_unique_id"], file_path
-            )
+                path_new = await move_to_downloads_dir(
+                    attachment["type"],
+                    attachment["raw"]["file_unique_id"],
+                    str(file_path),
+                )
 
-            if not path_new:
-                continue
+                if not path_new:
+                    continue
+
+                file_name = path_new.name
+                logger.info(f"Saved {attachment['type'].upper()} to '{path_new}'")
 
             chat_language = (
                 message.language
@@ -243,11 +338,20 @@ async def download_message_attachments_async(
             # gather meta data for further processing (storage, ocr, asr)
             downloaded_attachment = {
                 "message_id": message.id,
-                "file_name": path_new.name,
+                "file_unique_id": attachment["raw"]["file_unique_id"],
+                "file_name": file_name,
                 "type": attachment["type"],
                 "language": chat_language,
             }
 
+            if storage:
+                downloaded_attachment["in_storage"] = True
+
+            if duplicate_message_ids.get(attachment["raw"]["file_unique_id"], None):
+                downloaded_attachment["duplicate_message_ids"] = duplicate_message_ids[
+                    attachment["raw"]["file_unique_id"]
+                ]
+
             # text recognition (ocr) for all image files
             if settings.ocr_enabled and is_image_file(attachment):
                 downloaded_attachment["action"] = "ocr"
@@ -260,8 +364,6 @@ async def download_message_attachments_async(
             ):
                 downloaded_attachment["action"] = "asr"
 
-            logger.info(f"Saved {attachment['type'].upper()} to '{path_new}'")
-
             # check if attachment has "thumbs" key and download thumbs
             # can be None
             if (
@@ -273,18 +375,41 @@ async def download_message_attachments_async(
                 thumb = attachment["raw"]["thumbs"][0]
 
                 logger.info("Downloading THUMBNAIL")
-                thumb_file_path = await download_file_from_telegram(
-                    thumb["file_id"], session_dir_with_slash, tg_client
-                )
 
-                if not thumb_file_path:
-                    continue
-
-                thumb_new_path = await move_to_downloads_dir(
-                    "thumbnail", thumb["file_unique_id"], thumb_file_path
-                )
-                logger.info(f"Saved THUMBNAIL to '{thumb_new_path}'")
-                downloaded_attachment["thumbnail"] = thumb_new_path.name
+                if storage:
+                    thumb_file_name = thumb["file_unique_id"] + get_file_extension(
+                        "thumbnail", thumb
+                    )
+
+                    if not await stream_file_to_storage(
+                        thumb["file_id"],
+                        "thumbnails",
+                        thumb_file_name,
+                        tg_client,
+                        storage,
+                        create_progress_callback(),
+                    ):
+                        continue
+
+                    logger.info("Streamed THUMBNAIL to storage")
+                else:
+                    thumb_file_path = await download_file_from_telegram(
+                        thumb["file_id"],
+                        session_dir_with_slash,
+                        tg_client,
+                        create_progress_callback(),
+                    )
+
+                    if not thumb_file_path:
+                        continue
+
+                    thumb_new_path = await move_to_downloads_dir(
+                        "thumbnail", thumb["file_unique_id"], thumb_file_path
+                    )
+                    thumb_file_name = thumb_new_path.name
+                    logger.info(f"Saved THUMBNAIL to '{thumb_new_path}'")
+
+                downloaded_attachment["thumbnail"] = thumb_file_name
 
             save_count += 1
             downloaded_attachments.append(downloaded_attachment)
@@ -306,3 +431,29 @@ def download_message_attachments(
     return asyncio.get_event_loop().run_until_complete(
         download_message_attachments_async(self, client_id, message_ids)
     )
+
+
+@app.task(
+    bind=True,
+    name="files.download_large_message_attachment",
+    autoretry_for=(TimeoutError, OSError),
+    retry_backoff=True,
+    max_retries=5,
+)
+def download_large_message_attachment(
+    self: celery.Task, client_id: str, message_id: str
+) -> dict:
+    remove_stale_partial_files(TMP_PATH.joinpath("partials"))
+
+    # large files are downloaded to disk in chunks to resume failed downloads
+    return asyncio.get_event_loop().run_until_complete(
+        download_message_attachments_async(
+            self,
+            client_id,
+            [message_id],
+            max_bytes_per_second=settings.download_large_files_bandwidth_mb
+            * 1024
+            * 1024,
+            resumable=True,
+        )
+    )
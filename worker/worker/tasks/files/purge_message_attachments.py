@@ -1,19 +1,184 @@
+import itertools
 from datetime import datetime, timedelta
-from typing import cast
+from typing import Dict, List, Set, Tuple, cast
 
+import celery
 from celery.utils.log import get_task_logger
-from minio.error import InvalidResponseError
+from minio.deleteobjects import DeleteObject
+from minio.error import S3Error
+from pymongo import UpdateOne
 
+from common.database.models.message import Message
 from common.settings import settings
 from common.storage import Storage
+from worker.attachments import get_file_unique_id
 from worker.database import Database
 from worker.main import app
 
 logger = get_task_logger(__name__)
 
+PURGE_BATCH_SIZE = 1000
+# number of messages checked for missing files after reconciling storage refs
+CONSISTENCY_CHECK_SAMPLE_SIZE = 100
 
-@app.task(name="files.purge_message_attachments")
-def purge_message_attachments() -> dict:
+
+def remove_objects_from_storage(
+    storage: Storage, objects: Dict[str, List[str]]
+) -> Set[Tuple[str, str]]:
+    """
+    Remove objects grouped by bucket with multi-object delete requests.
+    Returns the objects that could not be removed.
+    """
+    failed_objects = set()
+
+    for bucket_name, object_names in objects.items():
+        try:
+            # errors are returned lazily, the iterator sends the delete requests
+            for error in storage.client.remove_objects(
+                bucket_name, [DeleteObject(name) for name in object_names]
+            ):
+                logger.error(
+                    f'Error removing file "{bucket_name}/{error.name}" from storage ({error.code})'  # noqa: E501
+                )
+                failed_objects.add((bucket_name, error.name))
+        except Exception:
+            logger.error(
+                f'Error removing files from bucket "{bucket_name}"', exc_info=True
+            )
+            failed_objects.update((bucket_name, name) for name in object_names)
+
+    return failed_objects
+
+
+def purge_batch(
+    database: Database, storage: Storage, messages: List[Message], max_date: datetime
+) -> int:
+    file_unique_ids = [id for id in map(get_file_unique_id, messages) if id]
+
+    # keep files that are still referenced by recently scraped messages
+    kept_file_unique_ids = {
+        attachment.id
+        for attachment in database.attachments.find(
+            {"_id": {"$in": file_unique_ids}, "last_seen_at": {"$gte": max_date}},
+            {"_id": 1},
+        )
+    }
+
+    objects: Dict[str, List[str]] = {}
+    for message in messages:
+        if get_file_unique_id(message) in kept_file_unique_ids:
+            continue
+
+        for ref in cast(dict, message.attachment)["storage_refs"]:
+            objects.setdefault(ref["bucket"], []).append(ref["object"])
+
+    failed_objects = remove_objects_from_storage(storage, objects)
+
+    # remove storage refs in database unless removing one of the files failed
+    purged_messages = [
+        message
+        for message in messages
+        if not any(
+            (ref["bucket"], ref["object"]) in failed_objects
+            for ref in cast(dict, message.attachment)["storage_refs"]
+        )
+    ]
+
+    if purged_messages:
+        database.messages.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": message.id}, {"$unset": {"attachment.storage_refs": 1}}
+                )
+                for message in purged_messages
+            ],
+            ordered=False,
+        )
+
+    # remove files from attachment index
+    removed_file_unique_ids = [
+        file_unique_id
+        for file_unique_id in map(get_file_unique_id, purged_messages)
+        if file_unique_id and file_unique_id not in kept_file_unique_ids
+    ]
+    if removed_file_unique_ids:
+        database.attachments.delete_many({"_id": {"$in": removed_file_unique_ids}})
+
+    return len(purged_messages)
+
+
+def check_storage_refs(database: Database, storage: Storage) -> int:
+    """
+    Check a random sample of messages for storage refs pointing to missing files and
+    remove those refs. Returns the number of messages with missing files.
+    """
+    missing_message_ids = []
+
+    for doc in database.messages.aggregate(
+        [
+            {"$match": {"attachment.storage_refs": {"$exists": True}}},
+            {"$sample": {"size": CONSISTENCY_CHECK_SAMPLE_SIZE}},
+            {"$project": {"_id": 1, "attachment.storage_refs": 1}},
+        ]
+    ):
+        for ref in doc["attachment"]["storage_refs"]:
+            try:
+                storage.client.stat_object(ref["bucket"], ref["object"])
+            except S3Error as e:
+                if e.code == "NoSuchKey":
+                    missing_message_ids.append(doc["_id"])
+                    break
+                raise e
+
+    if missing_message_ids:
+        logger.warning(
+            f"Found {len(missing_message_ids)} of {CONSISTENCY_CHECK_SAMPLE_SIZE} sampled messages with missing files"  # noqa: E501
+        )
+        database.messages.update_many(
+            {"_id": {"$in": missing_message_ids}},
+            {"$unset": {"attachment.storage_refs": 1}},
+        )
+
+    return len(missing_message_ids)
+
+
+def reconcile_storage_refs(
+    database: Database, storage: Storage, max_date: datetime
+) -> dict:
+    """
+    Remove storage refs of files expired by the lifecycle rules of the storage
+    buckets (see "Storage.set_expiration").
+    """
+    # files uploaded before max_date have been deleted by the object storage
+    expired_file_unique_ids = [
+        attachment.id
+        for attachment in database.attachments.find(
+            {"stored_at": {"$lt": max_date}}, {"_id": 1}
+        )
+    ]
+
+    result = database.messages.update_many(
+        {
+            "$or": [
+                {"date": {"$lt": max_date}},
+                # newer messages reusing an expired file
+                {"attachment.raw.file_unique_id": {"$in": expired_file_unique_ids}},
+            ],
+            "attachment.storage_refs": {"$exists": True},
+        },
+        {"$unset": {"attachment.storage_refs": 1}},
+    )
+
+    if expired_file_unique_ids:
+        database.attachments.delete_many({"_id": {"$in": expired_file_unique_ids}})
+
+    missing_count = check_storage_refs(database, storage)
+
+    return {"delete_count": result.modified_count, "missing_count": missing_count}
+
+
+@app.task(bind=True, name="files.purge_message_attachments")
+def purge_message_attachments(self: celery.Task) -> dict:
     if settings.keep_attachment_files_days == 0:
         raise ValueError(
             'Trying to purge attachment files as scheduled, but setting is set to "0 days" (indefinitely)'  # noqa: E501
@@ -22,39 +187,43 @@ def purge_message_attachments() -> dict:
     database = Database()
     storage = Storage()
     delete_count = 0
+    batch_count = 0
+    max_date = datetime.utcnow() - timedelta(days=settings.keep_attachment_files_days)
+
+    if settings.purge_attachment_files_mode == "lifecycle":
+        result = reconcile_storage_refs(database, storage, max_date)
+        database.close()
+        return result
 
     # get message documents with attachments in storage
+    # Note: purged messages don't match anymore, so an interrupted purge resumes
+    # with the first unfinished batch when it runs again
     messages_cursor = database.messages.find(
         {
-            "date": {
-                "$lt": datetime.utcnow()
-                - timedelta(days=settings.keep_attachment_files_days)
-            },
+            "date": {"$lt": max_date},
             "attachment.storage_refs": {"$exists": True},
         },
-        {"_id": 1, "attachment.storage_refs": 1},
+        {"_id": 1, "attachment.storage_refs": 1, "attachment.raw.file_unique_id": 1},
+        batch_size=PURGE_BATCH_SIZE,
     )
 
-    for message in messages_cursor:
-        attachment = cast(dict, message.attachment)
+    while True:
+        messages = list(itertools.islice(messages_cursor, PURGE_BATCH_SIZE))
+        if not messages:
+            break
 
-        for ref in attachment["storage_refs"]:
-            try:
-                # remove object in storage
-                storage.client.remove_object(ref["bucket"], ref["object"])
-            except InvalidResponseError:
-                logger.error(
-                    f'Error removing file "{ref["bucket"]}/{ref["object"]}" from storage',  # noqa: E501
-                    exc_info=True,
-                )
-                break
-        else:
-            # remove storage refs in database for message attachment
-            database.messages.update_one(
-                {"_id": message.id}, {"$unset": {"attachment.storage_refs": 1}}
-            )
+        delete_count += purge_batch(database, storage, messages, max_date)
+        batch_count += 1
 
-            delete_count += 1
+        logger.info(f"Purged attachments of {delete_count} messages")
+        self.update_state(
+            state="PROGRESS",
+            meta={
+                "delete_count": delete_count,
+                "batch_count": batch_count,
+                "last_message_id": messages[-1].id,
+            },
+        )
 
     database.close()
 
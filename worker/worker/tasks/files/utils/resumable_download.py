@@ -0,0 +1,97 @@
+import json
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Tuple, Union
+
+from celery.utils.log import get_task_logger
+from pyrogram import types as pyrogram_types
+from pyrogram.client import Client as TelegramClient
+
+logger = get_task_logger(__name__)
+
+# pyrogram streams files in chunks of 1 MiB
+CHUNK_SIZE = 1024 * 1024
+# partial files not resumed within this time are removed
+PARTIAL_FILES_MAX_AGE = timedelta(days=1)
+
+
+def get_checkpoint_path(partial_path: Path) -> Path:
+    # chunk map is kept alongside the partial file e.g. "AgADBAADcqcxG.mp4.json"
+    return partial_path.with_name(partial_path.name + ".json")
+
+
+def read_checkpoint(partial_path: Path) -> Tuple[int, int]:
+    """
+    Get number of completed chunks and bytes written of a partial file.
+    """
+    checkpoint_path = get_checkpoint_path(partial_path)
+
+    if not partial_path.is_file() or not checkpoint_path.is_file():
+        return 0, 0
+
+    try:
+        checkpoint = json.loads(checkpoint_path.read_text())
+    except ValueError:
+        return 0, 0
+
+    if checkpoint.get("chunk_size", None) != CHUNK_SIZE or "size" not in checkpoint:
+        return 0, 0
+
+    return checkpoint.get("chunks", 0), checkpoint["size"]
+
+
+def write_checkpoint(partial_path: Path, chunks: int, size: int) -> None:
+    get_checkpoint_path(partial_path).write_text(
+        json.dumps({"chunk_size": CHUNK_SIZE, "chunks": chunks, "size": size})
+    )
+
+
+def remove_stale_partial_files(partials_dir: Path) -> None:
+    if not partials_dir.is_dir():
+        return
+
+    max_mtime = time.time() - PARTIAL_FILES_MAX_AGE.total_seconds()
+    for item in partials_dir.iterdir():
+        if item.is_file() and item.stat().st_mtime < max_mtime:
+            item.unlink()
+
+
+async def download_file_resumable(
+    tg_message_or_file_id: Union[str, pyrogram_types.Message],
+    partial_path: Path,
+    tg_client: TelegramClient,
+    file_size: int = 0,
+    progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+) -> Path:
+    """
+    Download a file chunk by chunk and record completed chunks, so a retry can
+    resume the download where it stopped. Errors are raised to the caller.
+    """
+    partial_path.parent.mkdir(parents=True, exist_ok=True)
+    chunks, size = read_checkpoint(partial_path)
+
+    if chunks:
+        logger.info(f"Resuming download of '{partial_path.name}' at chunk {chunks}")
+
+    with partial_path.open("a+b") as file:
+        # drop bytes written after the last checkpoint (the last chunk is shorter
+        # than CHUNK_SIZE, so the byte offset is recorded instead of computed)
+        file.truncate(size)
+        file.seek(0, 2)
+
+        async for chunk in tg_client.stream_media(
+            tg_message_or_file_id, offset=chunks
+        ):
+            file.write(chunk)
+            file.flush()
+            chunks += 1
+            write_checkpoint(partial_path, chunks, file.tell())
+
+            if progress:
+                current = file.tell()
+                await progress(min(current, file_size or current), file_size)
+
+    get_checkpoint_path(partial_path).unlink()
+
+    return partial_path
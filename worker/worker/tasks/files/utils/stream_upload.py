@@ -0,0 +1,147 @@
+import asyncio
+import functools
+import queue
+from mimetypes import guess_extension, guess_type
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Union
+
+from celery.utils.log import get_task_logger
+from pyrogram import types as pyrogram_types
+from pyrogram.client import Client as TelegramClient
+
+from common.storage import Storage
+
+logger = get_task_logger(__name__)
+
+# MinIO requires a part size of at least 5 MiB for multipart uploads
+STREAM_PART_SIZE = 10 * 1024 * 1024
+# max. number of chunks (1 MiB each) buffered between Telegram and MinIO
+STREAM_QUEUE_SIZE = 16
+
+# file extensions used by pyrogram if media has no file name or mime type
+DEFAULT_FILE_EXTENSIONS = {
+    "photo": ".jpg",
+    "thumbnail": ".jpg",
+    "voice": ".ogg",
+    "video": ".mp4",
+    "animation": ".mp4",
+    "video_note": ".mp4",
+    "sticker": ".webp",
+    "audio": ".mp3",
+}
+
+
+def get_file_extension(attachment_type: str, raw: dict) -> str:
+    """
+    Guess the file extension of an attachment the same way pyrogram does when it
+    saves media to disk.
+    """
+    file_name = raw.get("file_name", None)
+    if file_name and Path(file_name).suffix:
+        return Path(file_name).suffix
+
+    mime_type = raw.get("mime_type", None)
+    extension = guess_extension(mime_type) if mime_type else None
+
+    return extension or DEFAULT_FILE_EXTENSIONS.get(attachment_type, "")
+
+
+EOF = object()
+
+
+class ChunkStream:
+    """
+    File-like object that is read by MinIO (in a thread) while chunks are written
+    from the event loop.
+    """
+
+    def __init__(self, maxsize: int = STREAM_QUEUE_SIZE) -> None:
+        self.queue: queue.Queue = queue.Queue(maxsize)
+        self.buffer = bytearray()
+        self.eof = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            chunk = self.queue.get()
+
+            if chunk is EOF:
+                self.eof = True
+            elif isinstance(chunk, Exception):
+                # make MinIO abort the multipart upload
+                raise chunk
+            else:
+                self.buffer += chunk
+
+        if size < 0 or size >= len(self.buffer):
+            data = bytes(self.buffer)
+            self.buffer.clear()
+        else:
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+
+        return data
+
+
+async def stream_file_to_storage(
+    tg_message_or_file_id: Union[str, pyrogram_types.Message],
+    bucket_name: str,
+    object_name: str,
+    tg_client: TelegramClient,
+    storage: Storage,
+    progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+) -> bool:
+    """
+    Pipe the chunks of a Telegram file into a multipart upload of the object storage
+    without writing it to disk.
+    """
+    loop = asyncio.get_event_loop()
+    mime_type, encoding = guess_type(object_name)
+    stream = ChunkStream()
+
+    upload = loop.run_in_executor(
+        None,
+        functools.partial(
+            storage.client.put_object,
+            bucket_name,
+            object_name,
+            stream,
+            length=-1,
+            part_size=STREAM_PART_SIZE,
+            content_type=mime_type or "application/octet-stream",
+        ),
+    )
+
+    async def put(item) -> None:
+        # wait for free space in the queue unless the upload stopped reading it
+        while not upload.done():
+            try:
+                stream.queue.put_nowait(item)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.05)
+
+    try:
+        current = 0
+        async for chunk in tg_client.stream_media(tg_message_or_file_id):
+            if upload.done():
+                break
+            await put(chunk)
+
+            current += len(chunk)
+            if progress:
+                await progress(current, 0)
+    except Exception as e:
+        await put(e)
+    else:
+        await put(EOF)
+
+    try:
+        await upload
+    except Exception:
+        logger.error(
+            f"Could not stream media from Telegram API to '{bucket_name}/{object_name}'",  # noqa: E501
+            exc_info=True,
+        )
+        return False
+
+    return True
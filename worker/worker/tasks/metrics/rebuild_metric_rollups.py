@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+from celery.utils.log import get_task_logger
+
+from worker.aggregations import rebuild_metric_rollups as rebuild_rollups_in_database
+from worker.database import Database
+from worker.main import app
+
+logger = get_task_logger(__name__)
+
+
+@app.task(name="metrics.rebuild_metric_rollups")
+def rebuild_metric_rollups(days: int = 2) -> dict:
+    """
+    Recalculate the hourly metric rollups of the last days (all metrics if "days"
+    is 0), e.g. once after upgrading to fill the rollups with existing metrics.
+    """
+    database = Database()
+
+    since = datetime.utcnow() - timedelta(days=days) if days else datetime.min
+    rebuild_rollups_in_database(database, since)
+    logger.info(f"Rebuilt metric rollups since {since}")
+
+    database.close()
+
+    return {"since": since.isoformat()}
@@ -0,0 +1,19 @@
+from celery.utils.log import get_task_logger
+
+from worker.counters import reconcile_counters as reconcile_counters_in_database
+from worker.database import Database
+from worker.main import app
+
+logger = get_task_logger(__name__)
+
+
+@app.task(name="metrics.reconcile_counters")
+def reconcile_counters() -> dict:
+    database = Database()
+
+    counters = reconcile_counters_in_database(database)
+    logger.info(f"Reconciled counters ({counters.messages_count} messages)")
+
+    database.close()
+
+    return counters.dict(include={"users_count", "chats_count", "messages_count"})
@@ -1,19 +1,16 @@
 from mimetypes import guess_type
 from pathlib import Path
-from typing import List
+from typing import List, Union
 
 from celery.utils.log import get_task_logger
 from minio.error import InvalidResponseError
 
 from common.settings import settings
 from common.storage import Storage, StorageBucketNames
+from worker.attachments import index_attachment
 from worker.database import Database
 from worker.main import app
-from worker.tasks.process.utils.speech_recognition import (
-    load_model_speech_recognition,
-    recognize_speech,
-)
-from worker.tasks.process.utils.text_recognition import recognize_text
+from worker.tasks.process.utils.image_hash import compute_image_hash
 
 logger = get_task_logger(__name__)
 TMP_PATH = Path().cwd().joinpath("tmp")
@@ -44,121 +41,175 @@ def upload_file_to_storage(
     return True
 
 
-@app.task(name="process.process_attachments")
-def process_attachments(attachments: List[dict]) -> dict:
-    process_count = 0
-    ocr_text = None
-    asr_text = None
-    model_asr = None
+def read_file_from_storage(
+    bucket_name: str, object_name: str, storage: Storage
+) -> Union[bytes, None]:
+    try:
+        response = storage.client.get_object(bucket_name, object_name)
+    except Exception:
+        logger.error(
+            f"Error reading file '{bucket_name}/{object_name}' from storage",
+            exc_info=True,
+        )
+        return None
 
-    storage = Storage()
-    database = Database()
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
 
-    # load asr model if needed
-    if settings.asr_enabled and any(
-        attachment.get("action", None) == "asr" for attachment in attachments
-    ):
-        logger.info("Loading speech recognition model")
-        model_asr = load_model_speech_recognition(model_name=settings.asr_model_name)
 
-    for attachment in attachments:
-        bucket_name = bucket_name_from_attachment_type(attachment["type"])
-        object_name = attachment["file_name"]
-        file_path = TMP_PATH.joinpath(
-            "downloads",
-            bucket_name_from_attachment_type(attachment["type"]),
-            object_name,
+def get_message_ids(attachment: dict) -> List[str]:
+    # messages with the same file in the same download batch
+    return [attachment["message_id"]] + attachment.get("duplicate_message_ids", [])
+
+
+def save_attachment_data(database: Database, attachment: dict, save_data: dict):
+    try:
+        database.messages.update_many(
+            {"_id": {"$in": get_message_ids(attachment)}},
+            {"$set": save_data},
+        )
+    except Exception:
+        logger.error(
+            f"Couldn't update attachment of message {attachment['message_id']}",
+            exc_info=True,
         )
-        file_path_str = file_path.__str__()
 
-        # TODO: fingerprint/hash files to detect duplicates
 
-        # Note: file duplicates can exist but will be removed after the first upload
-        if file_path.is_file():
+@app.task(name="process.upload_attachment")
+def upload_attachment(attachment: dict) -> dict:
+    """
+    Upload a downloaded file to storage and save the storage refs. Returns the
+    attachment for the recognition stage (see "process_attachments").
+    """
+    storage = Storage()
+    database = Database()
 
-            upload_file_to_storage(file_path_str, bucket_name, object_name, storage)
+    bucket_name = bucket_name_from_attachment_type(attachment["type"])
+    object_name = attachment["file_name"]
+    file_path = TMP_PATH.joinpath(
+        "downloads",
+        bucket_name_from_attachment_type(attachment["type"]),
+        object_name,
+    )
+    file_path_str = file_path.__str__()
+    is_stored = attachment.get("in_storage", False)
+    image_hash = None
+
+    if is_stored:
+        # file was streamed into storage by the files worker
+        if attachment["type"] == "photo":
+            file_data = read_file_from_storage(bucket_name, object_name, storage)
+            image_hash = compute_image_hash(file_data) if file_data else None
+
+    # Note: file duplicates can exist but will be removed after the first upload
+    elif file_path.is_file():
+        # perceptual hash to find re-encoded copies of the same image
+        if attachment["type"] == "photo":
+            image_hash = compute_image_hash(file_path_str)
+
+        is_stored = upload_file_to_storage(
+            file_path_str, bucket_name, object_name, storage
+        )
 
-            logger.info(
-                f"Uploaded {attachment['type'].upper()} to storage '{object_name}'"
-            )
+        logger.info(f"Uploaded {attachment['type'].upper()} to storage '{object_name}'")
 
-            # recognize text (ocr) in image files
-            if "action" in attachment and attachment["action"] == "ocr":
-                logger.info(f"Starting text recognition ({attachment['language']})")
-                ocr_text = recognize_text(
-                    image=file_path_str,
-                    languages=[attachment["language"]],
-                    model_type=settings.ocr_model_type,
-                )
-
-            # recognize speech (asr) in audio files
-            if "action" in attachment and attachment["action"] == "asr" and model_asr:
-                logger.info(f"Starting speech recognition '{attachment['language']}'")
-
-                asr_text = recognize_speech(
-                    audio=file_path_str,
-                    model=model_asr,
-                )
-            try:
-                file_path.unlink()
-            except FileNotFoundError:
-                logger.error(f"File {file_path} not found", exc_info=True)
+        try:
+            file_path.unlink()
+        except FileNotFoundError:
+            logger.error(f"File {file_path} not found", exc_info=True)
 
-        else:
-            # TODO: Handle duplicates and fetch previous ocr/asr result
-            logger.info(f"Skipping '{object_name}' (already uploaded or file does not exist)")
+    else:
+        logger.info(
+            f"Skipping '{object_name}' (already uploaded or file does not exist)"
+        )
 
-        # create storage reference
-        storage_refs = [{"bucket": bucket_name, "object": object_name}]
+    # create storage reference
+    storage_refs = [{"bucket": bucket_name, "object": object_name}]
 
-        # check if attachment has "thumbs" key and download thumbnails
-        # can be None
-        if "thumbnail" in attachment:
-            thumb_object_name = attachment["thumbnail"]
-            thumb_file_path = TMP_PATH.joinpath(
-                "downloads",
+    # check if attachment has "thumbs" key and download thumbnails
+    # can be None
+    if "thumbnail" in attachment:
+        thumb_object_name = attachment["thumbnail"]
+        thumb_file_path = TMP_PATH.joinpath(
+            "downloads",
+            "thumbnails",
+            thumb_object_name,
+        )
+
+        if not attachment.get("in_storage", False) and thumb_file_path.is_file():
+            upload_file_to_storage(
+                thumb_file_path.__str__(),
                 "thumbnails",
                 thumb_object_name,
+                storage,
             )
+            logger.info(f"Uploaded THUMBNAIL to storage '{thumb_object_name}'")
 
-            if thumb_file_path.is_file():
-                upload_file_to_storage(
-                    thumb_file_path.__str__(),
-                    "thumbnails",
-                    thumb_object_name,
-                    storage,
-                )
-                logger.info(f"Uploaded THUMBNAIL to storage '{thumb_object_name}'")
-
-                try:
-                    thumb_file_path.unlink()
-                except FileNotFoundError:
-                    logger.error(f"File {thumb_file_path} not found", exc_info=True)
+            try:
+                thumb_file_path.unlink()
+            except FileNotFoundError:
+                logger.error(f"File {thumb_file_path} not found", exc_info=True)
 
-            # update storage references with thumbnails
-            storage_refs.append({"bucket": "thumbnails", "object": thumb_object_name})
+        # update storage references with thumbnails
+        storage_refs.append({"bucket": "thumbnails", "object": thumb_object_name})
 
-        # save storage refs and ocr / asr (if available) in db
-        save_data = {}
-        save_data["attachment.storage_refs"] = storage_refs
+    save_attachment_data(
+        database, attachment, {"attachment.storage_refs": storage_refs}
+    )
 
-        if ocr_text:
-            save_data["attachment.ocr"] = ocr_text
-        if asr_text:
-            save_data["attachment.transcription"] = asr_text
+    phash = image_hash.hash if image_hash else None
+    image_size = [image_hash.width, image_hash.height] if image_hash else None
 
+    # save file in attachment index to be reused for other messages
+    if is_stored and "file_unique_id" in attachment:
         try:
-            database.messages.update_one(
-                {"_id": attachment["message_id"]},
-                {"$set": save_data},
+            index_attachment(
+                database,
+                attachment["file_unique_id"],
+                attachment["type"],
+                storage_refs,
+                phash=phash,
+                image_size=image_size,
+                # cleared by the recognition stage
+                recognition_pending=attachment.get("action", None) in ("ocr", "asr"),
             )
         except Exception:
             logger.error(
-                f"Couldn't update storage references for {attachment['message_id']}",
+                f"Couldn't index attachment {attachment['file_unique_id']}",
                 exc_info=True,
             )
 
-        process_count += 1
-        logger.info(f"Processed {process_count}/{len(attachments)} attachments")
+    database.close()
+
+    return {
+        **attachment,
+        "in_storage": is_stored,
+        "phash": phash,
+        "image_size": image_size,
+    }
+
+
+@app.task(name="process.process_attachments")
+def process_attachments(attachments: List[dict]) -> dict:
+    """
+    Start a chain of tasks per attachment: the upload to storage, followed by text
+    or speech recognition. Each stage has its own queue, so slow recognition tasks
+    don't delay the storage refs of other attachments.
+    """
+    for attachment in attachments:
+        pipeline = upload_attachment.s(attachment)
+
+        # signatures by name, recognition tasks are only imported by their workers
+        if attachment.get("action", None) == "ocr":
+            pipeline |= app.signature("ocr.recognize_attachment_text")
+        elif attachment.get("action", None) == "asr":
+            pipeline |= app.signature("asr.recognize_attachment_speech")
+
+        pipeline.apply_async()
+
+    logger.info(f"Started processing of {len(attachments)} attachments")
 
-    return {"process_count": process_count}
+    return {"process_count": len(attachments)}
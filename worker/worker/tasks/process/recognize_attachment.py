@@ -0,0 +1,102 @@
+from celery.utils.log import get_task_logger
+
+from common.settings import settings
+from common.storage import Storage
+from worker.attachments import find_identical_image, update_indexed_attachment
+from worker.database import Database
+from worker.main import app
+from worker.tasks.process.process_attachments import (
+    bucket_name_from_attachment_type,
+    read_file_from_storage,
+    save_attachment_data,
+)
+
+logger = get_task_logger(__name__)
+
+
+@app.task(name="ocr.recognize_attachment_text")
+def recognize_attachment_text(attachment: dict) -> dict:
+    if not attachment.get("in_storage", False):
+        logger.warning(f"Skipping text recognition of '{attachment['file_name']}'")
+        return {"message_id": attachment["message_id"], "ocr": False}
+
+    # defer import, only ocr workers need tesseract (see worker.bootstrap)
+    from worker.tasks.process.utils.text_recognition import recognize_text
+
+    storage = Storage()
+    database = Database()
+    ocr_text = None
+
+    identical_image = (
+        find_identical_image(database, attachment["phash"], attachment["image_size"])
+        if attachment.get("phash", None) and attachment.get("image_size", None)
+        else None
+    )
+
+    if identical_image:
+        logger.info(f"Reusing text recognition of '{identical_image.id}'")
+        ocr_text = identical_image.ocr
+    else:
+        file_data = read_file_from_storage(
+            bucket_name_from_attachment_type(attachment["type"]),
+            attachment["file_name"],
+            storage,
+        )
+
+        if file_data:
+            logger.info(f"Starting text recognition ({attachment['language']})")
+            ocr_text = recognize_text(
+                image=file_data,
+                languages=[attachment["language"]],
+                model_type=settings.ocr_model_type,
+            )
+
+    if ocr_text:
+        save_attachment_data(database, attachment, {"attachment.ocr": ocr_text})
+
+    # finish recognition in index, even without results
+    if "file_unique_id" in attachment:
+        update_indexed_attachment(database, attachment["file_unique_id"], ocr=ocr_text)
+
+    database.close()
+
+    return {"message_id": attachment["message_id"], "ocr": bool(ocr_text)}
+
+
+@app.task(name="asr.recognize_attachment_speech")
+def recognize_attachment_speech(attachment: dict) -> dict:
+    if not settings.asr_enabled or not attachment.get("in_storage", False):
+        logger.warning(f"Skipping speech recognition of '{attachment['file_name']}'")
+        return {"message_id": attachment["message_id"], "transcription": False}
+
+    # defer import, only asr workers need vosk (see worker.bootstrap)
+    from worker.tasks.process.utils.speech_recognition import recognize_speech
+
+    storage = Storage()
+    database = Database()
+    asr_text = None
+
+    file_data = read_file_from_storage(
+        bucket_name_from_attachment_type(attachment["type"]),
+        attachment["file_name"],
+        storage,
+    )
+
+    if file_data:
+        logger.info(f"Starting speech recognition '{attachment['language']}'")
+        asr_text = recognize_speech(audio=file_data, model_name=settings.asr_model_name)
+
+    if asr_text:
+        save_attachment_data(
+            database, attachment, {"attachment.transcription": asr_text}
+        )
+
+    # finish recognition in index, even without results
+    if "file_unique_id" in attachment:
+        update_indexed_attachment(
+            database, attachment["file_unique_id"], transcription=asr_text
+        )
+
+    database.close()
+
+    return {"message_id": attachment["message_id"], "transcription": bool(asr_text)}
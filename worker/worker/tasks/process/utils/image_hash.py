@@ -0,0 +1,46 @@
+import io
+from typing import NamedTuple, Union
+
+from celery.utils.log import get_task_logger
+from PIL import Image
+
+logger = get_task_logger(__name__)
+
+# 16x16 difference hash: 256 bits / 64 hex characters
+HASH_SIZE = 16
+
+
+class ImageHash(NamedTuple):
+    hash: str
+    width: int
+    height: int
+
+
+def compute_image_hash(image: Union[str, bytes]) -> Union[ImageHash, None]:
+    """
+    Compute the difference hash (dHash) of an image. Re-encoded, rescaled or
+    slightly compressed copies of an image have the same or a similar hash.
+    Reference:
+    https://www.hackerfactor.com/blog/index.php?/archives/529-Kind-of-Like-That.html
+    """
+    try:
+        pil_image = Image.open(io.BytesIO(image) if isinstance(image, bytes) else image)
+        pixels = list(
+            pil_image.convert("L")
+            .resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+            .getdata()
+        )
+    except Exception:
+        logger.error("Couldn't compute image hash", exc_info=True)
+        return None
+
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+
+    return ImageHash(
+        f"{bits:0{HASH_SIZE * HASH_SIZE // 4}x}", pil_image.width, pil_image.height
+    )
@@ -1,13 +1,25 @@
+import io
 import json
+import os
+import socket
 import subprocess
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Union
+from typing import Callable, Dict, Optional, Tuple, Union
 from urllib import request
 
 from celery.utils.log import get_task_logger
 from vosk import KaldiRecognizer, Model, SetLogLevel
 
+from common.settings import settings
+from worker.tasks.process.utils.voice_activity import (
+    VoiceActivityFilter,
+    split_pcm_at_silence,
+)
+
 logger = get_task_logger(__name__)
 
 # Pre-trained language models provided by vosk
@@ -65,42 +77,27 @@ PRETRAINED_VOSK_MODELS = [
 ]
 
 WAV_SAMPLE_RATE = 16000
+# 16-bit mono PCM: 2 bytes per sample
+PCM_BYTES_PER_SECOND = 2 * WAV_SAMPLE_RATE
+# long audio is split into segments of about this length for parallel recognition
+PARALLEL_SEGMENT_SECONDS = 60
+# segments are split at the quietest point within the last seconds of a segment
+PARALLEL_SPLIT_SEARCH_SECONDS = 5
+VOSK_MODELS_PATH = Path.cwd().joinpath("worker/models/vosk")
 
 
-def get_duration(media):
-    result = subprocess.run(
-        [
-            "ffprobe",
-            "-v",
-            "error",
-            "-show_entries",
-            "format=duration",
-            "-of",
-            "default=noprint_wrappers=1:nokey=1",
-            media,
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-    )
-    return float(result.stdout)
-
-
-def load_model_speech_recognition(model_name: str):
-    # Loglevel for Vosk / Kaldi:
-    # 0 - default value to print info and error messages but no debug
-    # less than 0 - don't print info messages
-    # greather than 0 - more verbose mode
-    SetLogLevel(-1)
-
-    model = None
-    model_dir = Path.cwd().joinpath("worker/models/vosk")
+def download_model_speech_recognition(model_name: str) -> bool:
+    """
+    Check if model exists locally or download it (if it is a pretrained model).
+    """
+    model_dir = VOSK_MODELS_PATH
     model_path = model_dir.joinpath(model_name)
 
     # language model file does not exist locally
     if not model_path.is_dir():
         if model_name not in PRETRAINED_VOSK_MODELS:
             logger.error(f"Model {model_path} does not exist at this location")
-            return
+            return False
 
         # download language model if pretrained model exists
         model_file_name = model_name + ".zip"
@@ -137,6 +134,22 @@ def load_model_speech_recognition(model_name: str):
                 exc_info=True,
             )
 
+    return model_path.is_dir()
+
+
+def load_model_speech_recognition(model_name: str):
+    # Loglevel for Vosk / Kaldi:
+    # 0 - default value to print info and error messages but no debug
+    # less than 0 - don't print info messages
+    # greather than 0 - more verbose mode
+    SetLogLevel(-1)
+
+    model = None
+    model_path = VOSK_MODELS_PATH.joinpath(model_name)
+
+    if not download_model_speech_recognition(model_name):
+        return
+
     try:
         start_time = time.time()
         model = Model(model_path.as_posix())
@@ -148,10 +161,90 @@ def load_model_speech_recognition(model_name: str):
         logger.error(f"Failed loading model {model_path}", exc_info=True)
 
 
-def recognize_speech(audio: str, model: Model) -> Union[str, None]:
-    # TODO: implement vosk-server (docker) for large models
+def get_model_size(model_name: str) -> int:
+    """
+    Estimate memory usage of a model (in bytes) by its size on disk.
+    """
+    model_path = VOSK_MODELS_PATH.joinpath(model_name)
 
-    # transcode audio
+    if not model_path.is_dir():
+        return 0
+
+    return sum(f.stat().st_size for f in model_path.glob("**/*") if f.is_file())
+
+
+class ModelRegistry:
+    """
+    Keeps loaded speech recognition models in memory across tasks (one registry per
+    worker process). Least recently used models are unloaded if the memory budget is
+    exceeded.
+    """
+
+    def __init__(self, max_memory_mb: int) -> None:
+        self.max_memory = max_memory_mb * 1024 * 1024
+        self.models: OrderedDict[str, Tuple[Model, int]] = OrderedDict()
+        # the asr server accesses the registry from multiple threads, models are
+        # loaded outside of "lock" (one lock per model), so loading a model doesn't
+        # block threads using other models
+        self.lock = threading.Lock()
+        self.loading_locks: Dict[str, threading.Lock] = {}
+
+    @property
+    def memory_usage(self) -> int:
+        return sum(size for model, size in self.models.values())
+
+    def get_loaded(self, model_name: str) -> Union[Model, None]:
+        with self.lock:
+            if model_name not in self.models:
+                return None
+            self.models.move_to_end(model_name)
+            return self.models[model_name][0]
+
+    def get(self, model_name: str) -> Union[Model, None]:
+        model = self.get_loaded(model_name)
+        if model:
+            return model
+
+        with self.lock:
+            loading_lock = self.loading_locks.setdefault(model_name, threading.Lock())
+
+        with loading_lock:
+            # loaded by another thread in the meantime
+            model = self.get_loaded(model_name)
+            if model:
+                return model
+
+            model = load_model_speech_recognition(model_name=model_name)
+            if not model:
+                return None
+
+            with self.lock:
+                self.models[model_name] = (model, get_model_size(model_name))
+                self.evict()
+
+            return model
+
+    def evict(self) -> None:
+        # always keep the most recently used model
+        while len(self.models) > 1 and self.memory_usage > self.max_memory:
+            model_name, _ = self.models.popitem(last=False)
+            logger.info(f"Unloaded model '{model_name}' (memory budget exceeded)")
+
+
+model_registry = ModelRegistry(max_memory_mb=settings.asr_model_cache_mb)
+
+
+def write_to_stdin(process: subprocess.Popen, data: bytes):
+    try:
+        process.stdin.write(data)  # type: ignore
+    except BrokenPipeError:
+        pass
+    finally:
+        process.stdin.close()  # type: ignore
+
+
+def transcode_audio(audio: Union[str, bytes]) -> Union[subprocess.Popen, None]:
+    # transcode audio (read from stdin if audio file is passed as bytes)
     try:
         process = subprocess.Popen(
             [
@@ -159,7 +252,7 @@ def recognize_speech(audio: str, model: Model) -> Union[str, None]:
                 "-loglevel",
                 "quiet",
                 "-i",  # input
-                audio,
+                "pipe:0" if isinstance(audio, bytes) else audio,
                 "-ar",  # audio sampling frequency
                 str(WAV_SAMPLE_RATE),
                 "-ac",  # number of audio channels
@@ -168,44 +261,233 @@ def recognize_speech(audio: str, model: Model) -> Union[str, None]:
                 "s16le",  # PCM signed 16-bit little-endian
                 "-",
             ],
+            stdin=subprocess.PIPE if isinstance(audio, bytes) else None,
             stdout=subprocess.PIPE,
         )
     except Exception:
         logger.error(
-            f"Can't read audio file {audio}",
+            "Can't read audio file",
             exc_info=True,
         )
-        return
+        return None
+
+    if isinstance(audio, bytes):
+        # feed stdin in a thread, reading stdout at the same time prevents deadlocks
+        threading.Thread(target=write_to_stdin, args=(process, audio)).start()
+
+    return process
+
+
+def recognize_pcm(read: Callable[[int], bytes], model: Model) -> Tuple[str, float]:
+    """
+    Recognize speech in a stream of 16-bit mono PCM audio.
+    Returns the text and the duration of the audio in seconds.
+    """
+    recognizer = KaldiRecognizer(model, WAV_SAMPLE_RATE)
+    result = []
+    pcm_bytes = 0
+
+    while True:
+        data = read(4000)
+
+        if len(data) == 0:
+            break
+        pcm_bytes += len(data)
+        if recognizer.AcceptWaveform(data):
+            partial_result = json.loads(recognizer.Result())
+            result.append(partial_result["text"])
+
+    final = json.loads(recognizer.FinalResult())
+    result.append(final["text"])
+
+    duration = pcm_bytes / PCM_BYTES_PER_SECOND
+
+    return "\n".join(result), duration
+
+
+def connect_to_server(address: str, timeout: float) -> socket.socket:
+    # address is either a path to a unix socket or "host:port"
+    if address.startswith("/"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address)
+        return sock
+
+    host, port = address.rsplit(":", 1)
+    return socket.create_connection((host, int(port)), timeout=timeout)
+
+
+def recognize_pcm_remote(pcm: bytes, model_name: str, address: str) -> str:
+    """
+    Send PCM audio to the asr server (see worker/asr_server.py).
+    """
+    # the server responds after recognizing the whole audio
+    timeout = settings.asr_server_timeout_seconds + len(pcm) / PCM_BYTES_PER_SECOND
+
+    with connect_to_server(address, timeout) as sock:
+        sock.sendall(json.dumps({"model": model_name}).encode() + b"\n")
+        sock.sendall(pcm)
+
+        # signal end of audio and wait for the result
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile("rb") as response_file:
+            response = json.loads(response_file.readline())
+
+    if "error" in response:
+        raise RuntimeError(f"ASR server error: {response['error']}")
+
+    return response["text"]
+
+
+def recognize_pcm_with_model(
+    read: Callable[[int], bytes], model_name: str, model: Optional[Model] = None
+) -> Tuple[str, float]:
+    """
+    Recognize speech with a loaded model or the asr server. Falls back to a local
+    model if the server can't be reached or doesn't respond in time.
+    Returns the text and the duration of the audio in seconds.
+    """
+    if model:
+        return recognize_pcm(read, model)
+
+    # buffer audio, so it can be recognized locally if the server fails
+    pcm = b"".join(iter(lambda: read(4000), b""))
+    duration = len(pcm) / PCM_BYTES_PER_SECOND
+
+    try:
+        text = recognize_pcm_remote(
+            pcm, model_name, settings.asr_server_address  # type: ignore
+        )
+        return text, duration
+    except OSError:
+        logger.warning(
+            "ASR server not available, recognizing speech locally", exc_info=True
+        )
+
+    model = model_registry.get(model_name)
+    if not model:
+        raise RuntimeError(f"Model '{model_name}' not available")
+
+    return recognize_pcm(io.BytesIO(pcm).read, model)
+
+
+def format_timestamp(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def recognize_segment(
+    pcm: bytes, model_name: str, model: Optional[Model] = None
+) -> str:
+    read = io.BytesIO(pcm).read
+
+    # skip silence within segment (no early abort, later segments may have speech)
+    if settings.asr_vad_enabled:
+        vad = VoiceActivityFilter(read, sample_rate=WAV_SAMPLE_RATE)
+        read = vad.read
+
+    text, duration = recognize_pcm_with_model(read, model_name, model)
+
+    return " ".join(line for line in text.split("\n") if line)
+
+
+def recognize_pcm_parallel(
+    pcm: bytes, model_name: str, model: Optional[Model] = None
+) -> str:
+    """
+    Split long audio at silence and recognize the segments in parallel. Returns
+    the transcript with one line per segment prefixed by its start time.
+    """
+    segments = split_pcm_at_silence(
+        pcm,
+        sample_rate=WAV_SAMPLE_RATE,
+        segment_seconds=PARALLEL_SEGMENT_SECONDS,
+        search_seconds=PARALLEL_SPLIT_SEARCH_SECONDS,
+    )
+
+    # Note: threads instead of processes, celery worker processes can't have child
+    # processes and vosk releases the GIL while recognizing (the model is shared)
+    with ThreadPoolExecutor(
+        max_workers=settings.asr_parallel_workers or os.cpu_count()
+    ) as executor:
+        texts = executor.map(
+            lambda segment: recognize_segment(segment[1], model_name, model),
+            segments,
+        )
+
+        return "\n".join(
+            f"[{format_timestamp(start / PCM_BYTES_PER_SECOND)}] {text}"
+            for (start, _), text in zip(segments, texts)
+            if text
+        )
+
+
+def recognize_speech(audio: Union[str, bytes], model_name: str) -> Union[str, None]:
+    model = None
+
+    if not settings.asr_server_address:
+        model = model_registry.get(model_name)
+        if not model:
+            return None
+
+    process = transcode_audio(audio)
+    if not process:
+        return None
 
     try:
         start_time = time.time()
-        recognizer = KaldiRecognizer(model, WAV_SAMPLE_RATE)
-        result = []
+        read = process.stdout.read  # type: ignore
 
-        while True:
-            data = process.stdout.read(4000)
-            # TODO: stop recognition if no voice detected after first few seconds
+        if settings.asr_parallel_min_seconds:
+            min_size = settings.asr_parallel_min_seconds * PCM_BYTES_PER_SECOND
+            pcm = read(min_size)
 
-            if len(data) == 0:
-                break
-            if recognizer.AcceptWaveform(data):
-                partial_result = json.loads(recognizer.Result())
-                result.append(partial_result["text"])
+            if len(pcm) == min_size:
+                # long audio, read the rest and recognize segments in parallel
+                pcm += read()
+                text = recognize_pcm_parallel(pcm, model_name, model)
 
-        final = json.loads(recognizer.FinalResult())
-        result.append(final["text"])
+                end_time = round(time.time() - start_time, 2)
+                logger.info(
+                    f"Parallel ASR of {round(len(pcm) / PCM_BYTES_PER_SECOND)}s audio took {end_time} s"  # noqa: E501
+                )
 
-        end_time = round(time.time() - start_time, 2)
+                return text
 
-        duration = get_duration(audio)
+            read = io.BytesIO(pcm).read
+
+        # skip silence and music, only spans with speech are recognized
+        vad = None
+        if settings.asr_vad_enabled:
+            vad = VoiceActivityFilter(
+                read,
+                sample_rate=WAV_SAMPLE_RATE,
+                abort_after_seconds=settings.asr_vad_abort_after_seconds,
+            )
+            read = vad.read
+
+        text, duration = recognize_pcm_with_model(read, model_name, model)
+
+        end_time = round(time.time() - start_time, 2)
         logger.info(f"ASR of {round(duration)}s audio using took {end_time} s")
 
-        text = "\n".join(result)
+        if vad:
+            if vad.aborted:
+                logger.info(
+                    f"Stopped ASR, no speech detected in first {settings.asr_vad_abort_after_seconds}s of audio"  # noqa: E501
+                )
+            logger.info(
+                f"Skipped {round(vad.skipped_seconds)}s of audio without speech"
+            )
 
         return text
 
     except Exception:
         logger.error(
-            f"Speech recognition for {audio} failed",
+            "Speech recognition failed",
             exc_info=True,
         )
+    finally:
+        process.stdout.close()  # type: ignore
+        process.wait()
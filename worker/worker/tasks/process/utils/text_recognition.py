@@ -1,13 +1,38 @@
+import io
 import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Literal, Union
+from typing import List, Literal, Set, Tuple, Union
 from urllib import request
 
 import pytesseract
 from celery.utils.log import get_task_logger
+from PIL import Image, ImageFilter, ImageStat
+
+from common.settings import settings
+
+try:
+    # in-process tesseract api, falls back to running the tesseract cli per image
+    from tesserocr import PyTessBaseAPI
+except ImportError:
+    PyTessBaseAPI = None
 
 logger = get_task_logger(__name__)
 
+# max. number of initialized tesseract apis (language combinations) per process
+MAX_OCR_ENGINES = 4
+
+# larger images are downscaled before text recognition (longest side in pixels)
+MAX_IMAGE_SIZE = 2400
+# size of the image used to detect if an image likely contains text
+PREFILTER_IMAGE_SIZE = 1024
+# the image is divided into tiles, text is likely if any tile has enough edges
+PREFILTER_GRID_SIZE = 16
+# min. brightness of a pixel in the edge image to count as an edge
+PREFILTER_EDGE_THRESHOLD = 64
+# min. share of edge pixels in a tile to consider it containing text
+PREFILTER_MIN_EDGE_DENSITY = 0.08
+
 # Languages supported by tesseract as ISO 639-2/T codes
 # Reference: https://tesseract-ocr.github.io/tessdoc/Data-Files
 SUPPORTED_LANGUAGES_TESSERACT = (
@@ -118,72 +143,179 @@ def clean_text(text: str) -> Union[str, None]:
     return text
 
 
+def get_tesseract_language(language: str) -> Union[str, None]:
+    # match incoming ISO 639-1 language code with ISO 639-2/T language code
+    # (tesseract needs three character language codes)
+    # reference: https://en.wikipedia.org/wiki/List_of_ISO_639-1_codes
+    match = [s for s in SUPPORTED_LANGUAGES_TESSERACT if language == s[:2]]
+    return match[0] if match else None
+
+
+# (language, model type) of model files already checked by this process
+checked_models: Set[Tuple[str, str]] = set()
+
+
+def get_model_dir(model_type: str) -> Path:
+    return Path.cwd().joinpath("worker/models/tessdata", model_type)
+
+
+def ensure_model_file(language: str, model_type: str) -> bool:
+    """
+    Check if model file for language exists or download it (only once per process).
+    """
+    if (language, model_type) in checked_models:
+        return True
+
+    model_dir = get_model_dir(model_type)
+    model_file_name = language + ".traineddata"
+    model_path = model_dir.joinpath(model_file_name)
+
+    # language model file does not exist locally
+    if not model_path.is_file():
+
+        if model_type == "custom":
+            logger.error(f"Custom model {model_path} does not exist at this location")
+            return False
+
+        # download language model if type is "fast" or "best"
+        remote_model_url = f"https://raw.githubusercontent.com/tesseract-ocr/tessdata_{model_type}/main/{language}.traineddata"  # noqa: E501
+
+        logger.info(f"Downloading language model from '{remote_model_url}'")
+
+        try:
+            model_dir.mkdir(parents=True, exist_ok=True)
+            request.urlretrieve(remote_model_url, model_path)
+        except Exception:
+            logger.error(
+                f"Failed downloading language model from '{remote_model_url}'",
+                exc_info=True,
+            )
+            return False
+
+    checked_models.add((language, model_type))
+    return True
+
+
+def is_text_likely(image: Image.Image) -> bool:
+    """
+    Cheap check for text in an image: text has a high density of sharp edges in
+    at least some part of the image, while most photos without text have not.
+    """
+    small_image = image.convert("L")
+    small_image.thumbnail((PREFILTER_IMAGE_SIZE, PREFILTER_IMAGE_SIZE))
+    edges = small_image.filter(ImageFilter.FIND_EDGES).point(
+        lambda p: 255 if p >= PREFILTER_EDGE_THRESHOLD else 0
+    )
+
+    width, height = edges.size
+    tile_width = max(width // PREFILTER_GRID_SIZE, 1)
+    tile_height = max(height // PREFILTER_GRID_SIZE, 1)
+
+    for x in range(0, width - tile_width + 1, tile_width):
+        for y in range(0, height - tile_height + 1, tile_height):
+            tile = edges.crop((x, y, x + tile_width, y + tile_height))
+            if ImageStat.Stat(tile).mean[0] / 255 >= PREFILTER_MIN_EDGE_DENSITY:
+                return True
+
+    return False
+
+
+def downscale_image(image: Image.Image) -> Image.Image:
+    if max(image.size) <= MAX_IMAGE_SIZE:
+        return image
+
+    image = image.copy()
+    image.thumbnail((MAX_IMAGE_SIZE, MAX_IMAGE_SIZE), Image.LANCZOS)
+    return image
+
+
+class OcrEngineRegistry:
+    """
+    Keep initialized tesseract apis per language combination and model type, so
+    traineddata files are not loaded again for every image. Least recently used
+    apis are ended if more than "max_engines" are initialized.
+    """
+
+    def __init__(self, max_engines: int) -> None:
+        self.max_engines = max_engines
+        self.engines: OrderedDict = OrderedDict()
+
+    def get(self, model_langs: str, model_type: str):
+        key = (model_langs, model_type)
+
+        if key in self.engines:
+            self.engines.move_to_end(key)
+            return self.engines[key]
+
+        engine = PyTessBaseAPI(path=str(get_model_dir(model_type)), lang=model_langs)
+        self.engines[key] = engine
+
+        while len(self.engines) > self.max_engines:
+            _, evicted_engine = self.engines.popitem(last=False)
+            evicted_engine.End()
+
+        return engine
+
+
+ocr_engine_registry = OcrEngineRegistry(max_engines=MAX_OCR_ENGINES)
+
+
 def recognize_text(
-    image: str,
+    image: Union[str, bytes],
     languages: List[str],
     model_type: Literal["fast", "best", "custom"] = "fast",
 ) -> Union[str, None]:
     text = None
-    matched_languages = []
-    for language in languages:
-        # match incoming ISO 639-1 language code with ISO 639-2/T language code
-        # (tesseract needs three character language codes)
-        # reference: https://en.wikipedia.org/wiki/List_of_ISO_639-1_codes
-        match = [s for s in SUPPORTED_LANGUAGES_TESSERACT if language == s[:2]]
-        matched_languages.append(match[0])
+    matched_languages = [
+        tesseract_language
+        for tesseract_language in map(get_tesseract_language, languages)
+        if tesseract_language
+    ]
 
     # language is not supported by text recognition
     if not matched_languages:
         logger.warn(f"Text recognition for language(s) '{*languages,}' not supported")
         return
 
-    model_dir = Path.cwd().joinpath("worker/models/tessdata", model_type)
-
-    # Reference: https://tesseract-ocr.github.io/tessdoc/tess3/ControlParams.html
-    custom_config = f"--tessdata-dir '{model_dir}'"
     # TODO: test new "thresholding_method": 1 = LeptonicaOtsu or 2 = Sauvola
     # TODO: test disabling dictionary: set load_system_dawg and load_freq_dawg to false
     # TODO: specify "user-patterns" (e.g. for URLs) and "user-words" for frequent words
 
     for language in matched_languages:
-        model_file_name = language + ".traineddata"
-        model_path = model_dir.joinpath(model_file_name)
-
-        # language model file does not exist locally
-        if not model_path.is_file():
-
-            if model_type == "custom":
-                logger.error(
-                    f"Custom model {model_path} does not exist at this location"
-                )
-                return
-
-            # download language model if type is "fast" or "best"
-            remote_model_url = f"https://raw.githubusercontent.com/tesseract-ocr/tessdata_{model_type}/main/{language}.traineddata"  # noqa: E501
-
-            logger.info(f"Downloading language model from '{remote_model_url}'")
-
-            try:
-                model_dir.mkdir(parents=True, exist_ok=True)
-                request.urlretrieve(remote_model_url, model_path)
-            except Exception:
-                logger.error(
-                    f"Failed downloading language model from '{remote_model_url}'",
-                    exc_info=True,
-                )
+        if not ensure_model_file(language, model_type) and model_type == "custom":
+            return
 
     start_time = time.time()
     model_langs = "+".join(matched_languages)
     try:
+        pil_image = Image.open(io.BytesIO(image) if isinstance(image, bytes) else image)
+
+        if settings.ocr_prefilter_enabled:
+            if not is_text_likely(pil_image):
+                logger.info("Skipped text recognition, image likely contains no text")
+                return None
+
+            pil_image = downscale_image(pil_image)
+
         # run text recognition
-        text = pytesseract.image_to_string(
-            image, lang=model_langs, config=custom_config
-        )
+        if PyTessBaseAPI:
+            engine = ocr_engine_registry.get(model_langs, model_type)
+            engine.SetImage(pil_image)
+            text = engine.GetUTF8Text()
+            engine.Clear()
+        else:
+            # Reference: https://tesseract-ocr.github.io/tessdoc/tess3/ControlParams.html  # noqa: E501
+            custom_config = f"--tessdata-dir '{get_model_dir(model_type)}'"
+            text = pytesseract.image_to_string(
+                pil_image,
+                lang=model_langs,
+                config=custom_config,
+            )
     except FileNotFoundError:
         logger.error(f"File {image} not found", exc_info=True)
     except Exception:
         logger.error(
-            f"Text recognition for {image} failed",
+            "Text recognition failed",
             exc_info=True,
         )
     end_time = round(time.time() - start_time, 2)
@@ -0,0 +1,136 @@
+import audioop
+import collections
+from typing import Callable, Deque, List, Tuple
+
+import webrtcvad
+
+# webrtcvad accepts frames of 10, 20 or 30 ms
+FRAME_DURATION_MS = 30
+# non-speech frames passed to the recognizer before and after speech, so words at
+# the edges are not cut off and the recognizer can detect the end of utterances
+PADDING_DURATION_MS = 300
+# 0 (least aggressive) to 3 (most aggressive about filtering out non-speech)
+VAD_AGGRESSIVENESS = 3
+
+
+class VoiceActivityFilter:
+    """
+    Wraps a reader of 16-bit mono PCM audio and only returns spans containing
+    speech. Stops reading (returns empty bytes) if no speech is detected within
+    the first "abort_after_seconds" seconds of audio.
+    """
+
+    def __init__(
+        self,
+        read: Callable[[int], bytes],
+        sample_rate: int,
+        abort_after_seconds: int = 0,
+    ) -> None:
+        self.read_audio = read
+        self.sample_rate = sample_rate
+        self.abort_after_seconds = abort_after_seconds
+        self.vad = webrtcvad.Vad(VAD_AGGRESSIVENESS)
+
+        self.frame_size = int(sample_rate * FRAME_DURATION_MS / 1000) * 2
+        padding_frames = PADDING_DURATION_MS // FRAME_DURATION_MS
+        self.padding: Deque[bytes] = collections.deque(maxlen=padding_frames)
+        self.triggered = False
+        self.trailing_frames = 0
+
+        self.speech_detected = False
+        self.aborted = False
+        self.total_frames = 0
+        self.skipped_frames = 0
+
+    @property
+    def skipped_seconds(self) -> float:
+        return self.skipped_frames * FRAME_DURATION_MS / 1000
+
+    def read_frame(self) -> bytes:
+        frame = self.read_audio(self.frame_size)
+        self.total_frames += 1
+        return frame
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Returns the next voiced span (independent of "size"), empty bytes at the end.
+        """
+        while not self.aborted:
+            frame = self.read_frame()
+
+            # incomplete last frame can't be classified, pass it on if in speech
+            if len(frame) < self.frame_size:
+                if self.triggered:
+                    return frame
+                self.skipped_frames += len(self.padding) + (1 if frame else 0)
+                self.padding.clear()
+                return b""
+
+            is_speech = self.vad.is_speech(frame, self.sample_rate)
+
+            if self.triggered:
+                self.trailing_frames = 0 if is_speech else self.trailing_frames + 1
+                if self.trailing_frames >= (self.padding.maxlen or 0):
+                    self.triggered = False
+                return frame
+
+            if is_speech:
+                # start of speech, include preceding padding
+                self.triggered = True
+                self.speech_detected = True
+                self.trailing_frames = 0
+                data = b"".join(self.padding) + frame
+                self.padding.clear()
+                return data
+
+            if len(self.padding) == self.padding.maxlen:
+                self.skipped_frames += 1
+            self.padding.append(frame)
+
+            if (
+                self.abort_after_seconds
+                and not self.speech_detected
+                and self.total_frames * FRAME_DURATION_MS
+                >= self.abort_after_seconds * 1000
+            ):
+                self.aborted = True
+
+        return b""
+
+
+def split_pcm_at_silence(
+    pcm: bytes, sample_rate: int, segment_seconds: int, search_seconds: int
+) -> List[Tuple[int, bytes]]:
+    """
+    Split 16-bit mono PCM audio into segments of about "segment_seconds" each. Every
+    split is placed at the quietest frame within the last "search_seconds" before
+    the target length, so words are not cut in half.
+    Returns the segments with their start offset (in bytes).
+    """
+    frame_size = int(sample_rate * FRAME_DURATION_MS / 1000) * 2
+    segment_size = segment_seconds * sample_rate * 2
+    search_size = search_seconds * sample_rate * 2
+
+    segments = []
+    start = 0
+
+    while len(pcm) - start > segment_size:
+        end = start + segment_size
+        split = end
+
+        # find frame with lowest energy in search window
+        min_rms = None
+        for offset in range(end - search_size, end - frame_size + 1, frame_size):
+            rms = audioop.rms(pcm[offset : offset + frame_size], 2)
+            if min_rms is None or rms < min_rms:
+                min_rms = rms
+                split = offset + frame_size // 2
+
+        # keep samples aligned
+        split -= split % 2
+        segments.append((start, pcm[start:split]))
+        start = split
+
+    segments.append((start, pcm[start:]))
+
+    return segments
@@ -1,7 +1,6 @@
 from datetime import datetime, timedelta
-from typing import Iterable, List, Tuple, Union, cast
+from typing import Dict, Iterable, List, Tuple, Union, cast
 
-import gcld3
 from bson.objectid import ObjectId
 from celery.utils.log import get_task_logger
 from pydantic import ValidationError
@@ -10,13 +9,15 @@ from pyrogram import types as pyrogram_types
 from pyrogram.client import Client as TelegramClient
 from pyrogram.errors import exceptions
 
+from common.database.aggregations import ACTIVITY_SERIES, GROWTH_SERIES, HOURLY
 from common.database.models.chat import Chat, ChatMetrics, ChatType
 from common.database.models.message import Message
 from common.database.models.metric import Metric
 from common.settings import settings
 from common.utils import run_pyrogram_method_with_retry
 from worker import tasks
-from worker.aggregations import aggregate_metrics
+from worker.aggregations import aggregate_metric_series
+from worker.attachments import reuse_indexed_attachments
 from worker.database import Database
 from worker.main import app
 
@@ -30,6 +31,9 @@ def get_language_detector():
     global language_detector
 
     if language_detector is None:
+        # defer import, only scraping workers need gcld3
+        import gcld3
+
         language_detector = gcld3.NNetLanguageIdentifier(  # type: ignore
             min_num_bytes=0, max_num_bytes=1000
         )
@@ -67,55 +71,124 @@ def iter_history(
                 return
 
 
-def get_chat_language(
-    chat_id: int, chat_doc: Union[Chat, None], tg_client: TelegramClient
-) -> Tuple[Union[str, None], Union[List[str], None]]:
-    language = getattr(chat_doc, "language", None)
-    language_other = getattr(chat_doc, "language_other", None)
+# supported lang codes by MongoDb
+# see https://docs.mongodb.com/manual/reference/text-search-languages/
+SUPPORTED_LANGUAGES_MONGODB = (
+    "da",
+    "nl",
+    "en",
+    "fi",
+    "fr",
+    "de",
+    "hu",
+    "it",
+    "nb",
+    "pt",
+    "ro",
+    "ru",
+    "es",
+    "sv",
+    "tr",
+)
+# number of messages per page returned by get_history()
+MESSAGES_PAGE_SIZE = 100
+# messages with shorter texts get the language of the chat
+MIN_LANGUAGE_DETECTION_LENGTH = 20
+# min. share of messages in a language to count as a language of the chat
+MIN_CHAT_LANGUAGE_SHARE = 0.1
+# language stats are scaled down above this number of messages, so the chat
+# language follows the recent messages
+MAX_LANGUAGE_STATS_COUNT = 1000
+
+
+def detect_languages(texts: List[Union[str, None]]) -> List[Union[str, None]]:
+    """
+    Detect the languages of a page of texts with the shared detector instance.
+    """
+    detector = get_language_detector()
+    languages: List[Union[str, None]] = []
 
-    if language:
-        return language, language_other
+    for text in texts:
+        if not text or len(text) < MIN_LANGUAGE_DETECTION_LENGTH:
+            languages.append(None)
+            continue
 
-    text_list = [
-        msg.text
-        for msg in cast(List[pyrogram_types.Message], tg_client.get_history(chat_id))
-        # TODO: catch exceptions during get_history() e.g. TimeoutError
-        if hasattr(msg, "text") and msg.text
-    ]
+        result = detector.FindLanguage(text)
+        languages.append(result.language if result.is_reliable else None)
 
-    if not text_list:
-        logger.warning(f'Could not detect language for chat "{chat_id}"')
-        return None, None
+    return languages
 
-    text_str = "\n".join(text_list)
-    detector = get_language_detector()
-    # supported lang codes by MongoDb
-    # see https://docs.mongodb.com/manual/reference/text-search-languages/
-    supported_lang_codes = (
-        "da",
-        "nl",
-        "en",
-        "fi",
-        "fr",
-        "de",
-        "hu",
-        "it",
-        "nb",
-        "pt",
-        "ro",
-        "ru",
-        "es",
-        "sv",
-        "tr",
+
+def set_message_languages(
+    messages: List[Message],
+    chat_language: Union[str, None],
+    language_stats: Dict[str, int],
+) -> None:
+    languages = detect_languages([msg.text or msg.caption for msg in messages])
+
+    for language in languages:
+        if language:
+            language_stats[language] = language_stats.get(language, 0) + 1
+
+    # chats scraped for the first time have no language yet, use the languages of
+    # the messages scraped so far
+    if not chat_language:
+        chat_language, _ = get_chat_language(language_stats)
+
+    for message, language in zip(messages, languages):
+        # fall back to chat language for short texts and languages not supported
+        # by the text index of mongodb
+        message.language = (
+            language if language in SUPPORTED_LANGUAGES_MONGODB else chat_language
+        )
+
+
+def set_missing_message_languages(
+    database: Database, container: ResultsContainer, chat_id: int, language: str
+) -> None:
+    for message in container.data["messages"]:
+        if message["chat"]["_id"] == chat_id and not message.get("language", None):
+            message["language"] = language
+
+    database.messages.update_many(
+        {"chat._id": chat_id, "language": None}, {"$set": {"language": language}}
     )
+
+
+def scale_language_stats(language_stats: Dict[str, int]) -> Dict[str, int]:
+    total = sum(language_stats.values())
+    if total <= MAX_LANGUAGE_STATS_COUNT:
+        return language_stats
+
+    factor = MAX_LANGUAGE_STATS_COUNT / total
+    return {
+        language: round(count * factor)
+        for language, count in language_stats.items()
+        if round(count * factor) > 0
+    }
+
+
+def get_chat_language(
+    language_stats: Dict[str, int]
+) -> Tuple[Union[str, None], Union[List[str], None]]:
+    """
+    Get the languages of a chat from the languages of its messages.
+    """
+    total = sum(language_stats.values())
+    if not total:
+        return None, None
+
     languages = [
-        result.language
-        for result in detector.FindTopNMostFreqLangs(text_str, num_langs=3)
-        if result.is_reliable
-    ]
+        language
+        for language in sorted(language_stats, key=language_stats.get, reverse=True)
+        if language_stats[language] / total >= MIN_CHAT_LANGUAGE_SHARE
+    ][:3]
+
     # save first language if supported by mongodb
     language = (
-        languages[0] if languages and languages[0] in supported_lang_codes else None
+        languages[0]
+        if languages and languages[0] in SUPPORTED_LANGUAGES_MONGODB
+        else None
     )
     # save secondary language and languages not supported by mongodb
     if language:
@@ -135,6 +208,27 @@ def generate_requests(key, documents) -> List[Union[ReplaceOne, InsertOne]]:
         raise ValueError(f'No database action specified for key "{key}"')
 
 
+def add_messages(
+    client_id: str,
+    container: ResultsContainer,
+    messages: List[Message],
+    chat_language: Union[str, None],
+    language_stats: Dict[str, int],
+) -> None:
+    # detect languages of a page of messages at once
+    set_message_languages(messages, chat_language, language_stats)
+
+    for message in messages:
+        container.add("messages", message)
+    messages.clear()
+
+    # update database
+    if container.is_full:
+        container.save_to_database()
+        run_download_task(client_id, container)
+        container.clear_data()
+
+
 def run_download_task(client_id: str, container: ResultsContainer):
     message_documents = container.data["messages"]
     if not message_documents:
@@ -155,13 +249,32 @@ def run_download_task(client_id: str, container: ResultsContainer):
             and msg["attachment"]["type"] in wanted_file_types
         )
 
-    message_ids_with_attachments = [
-        str(msg["_id"]) for msg in message_documents if is_valid_message(msg)
-    ]
+    # reuse files (and ocr / asr results) that were already downloaded for other
+    # messages instead of downloading them again
+    messages_with_attachments = reuse_indexed_attachments(
+        container.database,
+        [msg for msg in message_documents if is_valid_message(msg)],
+    )
 
-    if message_ids_with_attachments:
+    # route files into size classes: small files are downloaded in batches,
+    # large files one by one (on their own queue)
+    max_file_size = settings.download_large_file_size_mb * 1024 * 1024
+    small_message_ids = []
+
+    for msg in messages_with_attachments:
+        file_size = (msg["attachment"].get("raw", None) or {}).get("file_size", 0)
+
+        if file_size and file_size > max_file_size:
+            tasks.download_large_message_attachment.s(
+                client_id=client_id, message_id=str(msg["_id"])
+            ).apply_async()
+        else:
+            small_message_ids.append(str(msg["_id"]))
+
+    batch_size = settings.download_small_files_batch_size
+    for i in range(0, len(small_message_ids), batch_size):
         tasks.download_message_attachments.s(
-            client_id=client_id, message_ids=message_ids_with_attachments
+            client_id=client_id, message_ids=small_message_ids[i : i + batch_size]
         ).apply_async()
 
 
@@ -206,7 +319,8 @@ def scrape_chats(client_id: str, chat_ids: List[int]) -> None:
     db_chat_docs = {
         chat.id: chat
         for chat in database.chats.find(
-            {"_id": {"$in": chat_ids}}, {"_id": 1, "language": 1, "language_other": 1}
+            {"_id": {"$in": chat_ids}},
+            {"_id": 1, "language": 1, "language_other": 1, "language_stats": 1},
         )
     }
 
@@ -262,42 +376,27 @@ def scrape_chats(client_id: str, chat_ids: List[int]) -> None:
                         exc_info=True,
                     )
 
-            # aggregate activity (message_posted) for last 24 hours
+            # aggregate activity (message_posted) and growth (members_count) for
+            # last 24 hours
             yesterday = datetime.utcnow() - timedelta(days=1)
-            activity_last_day = aggregate_metrics(
-                database,
-                {
-                    "metadata.chat_id": new_chat.id,
-                    "metadata.type": "message_posted",
-                    "ts": {"$gte": yesterday},
-                },
-                "$sum",
-            )
-
-            # aggregate growth (members_count) for last 24 hours
-            growth_last_day = aggregate_metrics(
+            metrics = aggregate_metric_series(
                 database,
-                {
-                    "metadata.chat_id": new_chat.id,
-                    "metadata.type": "chat_members_count",
-                    "ts": {"$gte": yesterday},
-                },
-                "$avg",
+                {"metadata.chat_id": new_chat.id, "ts": {"$gte": yesterday}},
+                {**ACTIVITY_SERIES, **GROWTH_SERIES},
+                resolution=HOURLY,
             )
 
             # TODO: Improve (won't consider the messages that are being scraped after)
             new_chat.metrics = ChatMetrics(
-                activity_last_day=activity_last_day, growth_last_day=growth_last_day
+                activity_last_day=metrics["activity_total"],
+                growth_last_day=metrics["growth_total"],
             )
 
-            # detect chat language
-            chat_language, chat_languages_other = get_chat_language(
-                tg_chat_id, db_chat_docs.get(tg_chat_id, None), tg_client
-            )
-            new_chat.language = chat_language
-            new_chat.language_other = chat_languages_other
-
-            container.add("chats", new_chat)
+            # chat language of previous scrapes is the fallback for short messages
+            chat_doc = db_chat_docs.get(tg_chat_id, None)
+            chat_language = getattr(chat_doc, "language", None)
+            language_stats = dict(getattr(chat_doc, "language_stats", None) or {})
+            page_messages: List[Message] = []
 
             # get id of last message in chat, if it exists in database
             latest_message = database.messages.find_one(
@@ -359,22 +458,46 @@ def scrape_chats(client_id: str, chat_ids: List[int]) -> None:
                             exc_info=True,
                         )
 
-                # add chat language
-                new_message.language = chat_language
-
                 # save users and message
                 [
                     container.add("users", user)
                     for user in new_users
                     if not container.has("users", "_id", user.id)
                 ]
-                container.add("messages", new_message)
+                page_messages.append(new_message)
+
+                if len(page_messages) >= MESSAGES_PAGE_SIZE:
+                    add_messages(
+                        client_id,
+                        container,
+                        page_messages,
+                        chat_language,
+                        language_stats,
+                    )
+
+            add_messages(
+                client_id, container, page_messages, chat_language, language_stats
+            )
+
+            # derive chat language from rolling stats of message languages
+            if language_stats:
+                new_chat.language_stats = scale_language_stats(language_stats)
+                new_chat.language, new_chat.language_other = get_chat_language(
+                    new_chat.language_stats
+                )
 
-                # update database
-                if container.is_full:
-                    container.save_to_database()
-                    run_download_task(client_id, container)
-                    container.clear_data()
+                # first scrape: short messages of pages before the first detected
+                # language get the language of the chat
+                if not chat_language and new_chat.language:
+                    set_missing_message_languages(
+                        database, container, tg_chat.id, new_chat.language
+                    )
+            else:
+                logger.warning(f'Could not detect language for chat "{tg_chat_id}"')
+                new_chat.language = chat_language
+                new_chat.language_other = getattr(chat_doc, "language_other", None)
+
+            container.add("chats", new_chat)
 
     # Finally, insert remaining results (even though container limit is not reached)
     if container.count():
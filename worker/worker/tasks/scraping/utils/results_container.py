@@ -4,6 +4,8 @@ from celery.utils.log import get_task_logger
 from pydantic.main import BaseModel
 from pymongo.errors import BulkWriteError
 
+from worker.aggregations import increment_metric_rollups
+from worker.counters import increment_counters
 from worker.database import Database
 
 CollectionName = Literal["chats", "messages", "users", "metrics"]
@@ -13,6 +15,20 @@ ResultsContainerData = Dict[CollectionName, List[Dict]]
 logger = get_task_logger(__name__)
 
 
+def get_new_documents(documents: List[Dict], bulk_api_result: Dict) -> List[Dict]:
+    """
+    Get documents that were inserted (or upserted) by a bulk write.
+    """
+    if bulk_api_result.get("upserted", None):
+        return [documents[upsert["index"]] for upsert in bulk_api_result["upserted"]]
+
+    if not bulk_api_result.get("nInserted", 0):
+        return []
+
+    failed_indexes = {error["index"] for error in bulk_api_result["writeErrors"]}
+    return [doc for i, doc in enumerate(documents) if i not in failed_indexes]
+
+
 class ResultsContainer:
     """
     Helper class to handle scraping results and perform database actions.
@@ -71,9 +87,25 @@ class ResultsContainer:
             requests = self.generate_requests(key, documents)
 
             try:
-                collection.bulk_write(requests, ordered=False).bulk_api_result
+                result = collection.bulk_write(requests, ordered=False).bulk_api_result
             except BulkWriteError as bwe:
                 # log errors other than duplicate key errors
                 if any(e["code"] != 11000 for e in bwe.details["writeErrors"]):
                     logger.error("Error saving documents to database", exc_info=True)
                     raise bwe
+                result = bwe.details
+
+            new_documents = get_new_documents(documents, result)
+
+            # update global counters with new documents
+            try:
+                increment_counters(self.database, key, new_documents)
+            except Exception:
+                logger.error("Error updating counters", exc_info=True)
+
+            # update hourly metric rollups (see "metrics.rebuild_metric_rollups")
+            if key == "metrics":
+                try:
+                    increment_metric_rollups(self.database, new_documents)
+                except Exception:
+                    logger.error("Error updating metric rollups", exc_info=True)